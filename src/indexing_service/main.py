@@ -1,11 +1,25 @@
+import argparse
 import logging
 from src.indexing_service.load_and_save import load_data
-from vectorize import vectorize_text, create_faiss_index, save_faiss_index_and_metadata
-from src.indexing_service.processing import process_data
-import os
+from vectorize import vectorize_text, create_faiss_index, publish_index_bundle
+from src.indexing_service.processing import process_data, extract_lead
+from src.shared.config import MODEL_NAME, MODEL_REVISION
+from src.shared.hierarchy import PageIndex
+from src.shared.metadata import ChunkMetadata
+from src.shared.profiling import Profiler, profile_run, stage
 import sys
+import time
 from typing import Any
 
+# Параметры разбиения и очистки текстов (записываются в манифест версии индекса)
+MIN_TEXT_LENGTH = 3
+MAX_CHUNK_LENGTH = 20000
+NEAR_DUPLICATE_THRESHOLD = 0.9
+
+# Параметры двухуровневого индекса: длина фрагмента и вводного текста страницы
+PASSAGE_LENGTH = 1000
+LEAD_LENGTH = 300
+
 # Настройка логирования
 logging.basicConfig(
     level=logging.INFO,
@@ -32,13 +46,44 @@ def validate_data(df: Any) -> bool:
 
     return True
 
-def main():
+def parse_args(argv=None) -> argparse.Namespace:
+    """Разбирает аргументы командной строки."""
+    parser = argparse.ArgumentParser(description="Создание и публикация векторного индекса")
+    parser.add_argument("--hierarchical", action="store_true",
+                        help="Построить двухуровневый индекс: страницы и сгруппированные по страницам фрагменты")
+    parser.add_argument("--passage-length", type=int, default=PASSAGE_LENGTH,
+                        help="Максимальная длина фрагмента в двухуровневом индексе")
+    parser.add_argument("--lead-length", type=int, default=LEAD_LENGTH,
+                        help="Длина вводного текста страницы для индекса страниц")
+    parser.add_argument("--profile", action="store_true",
+                        help="Записать время по этапам и сохранить отчет профилирования в data/profiles")
+    parser.add_argument("--profile-flamegraph", action="store_true",
+                        help="Дополнительно сэмплировать стеки для flamegraph (включает --profile)")
+    parser.add_argument("--profile-memory", action="store_true",
+                        help="Дополнительно отслеживать пик памяти через tracemalloc (включает --profile)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
     """Основной процесс создания и сохранения векторного индекса."""
+    args = parse_args(argv)
+    profiler = None
+    if args.profile or args.profile_flamegraph or args.profile_memory:
+        profiler = Profiler("indexing", flamegraph=args.profile_flamegraph, memory=args.profile_memory)
+    with profile_run(profiler):
+        _build_index(args)
+
+
+def _build_index(args: argparse.Namespace) -> None:
+    """Загружает, обрабатывает и векторизует данные и публикует новую версию индекса."""
     try:
+        started_at = time.perf_counter()
+
         # Загрузка данных
         url = "https://raw.githubusercontent.com/vladislavneon/RuBQ/refs/heads/master/RuBQ_2.0/RuBQ_2.0_paragraphs.json "
         logging.info(f"Загрузка данных из {url}")
-        df = load_data(url)
+        with stage("load_data"):
+            df = load_data(url)
 
         # Проверка данных
         if not validate_data(df):
@@ -47,24 +92,57 @@ def main():
 
         # Обработка данных
         logging.info("Начинаем обработку данных")
-        df = process_data(df, 'text')
-        texts = df['text'].tolist()
+        source_rows = len(df)
+        processing_started_at = time.perf_counter()
+        max_length = args.passage_length if args.hierarchical else MAX_CHUNK_LENGTH
+        df = process_data(df, 'text', min_text_length=MIN_TEXT_LENGTH, max_length=max_length,
+                          near_duplicate_threshold=NEAR_DUPLICATE_THRESHOLD)
+        if args.hierarchical:
+            # Фрагменты одной страницы должны идти подряд
+            df = df.sort_values("ru_wiki_pageid", kind="stable").reset_index(drop=True)
+            df["uid"] = range(len(df))
+        metadata = ChunkMetadata.from_dataframe(df)
+        texts = metadata.texts
+        processing_time = time.perf_counter() - processing_started_at
         logging.info(f"Обработано {len(texts)} текстовых фрагментов")
 
         # Создание эмбеддингов
         logging.info("Создаем эмбеддинги текстовых данных")
+        vectorizing_started_at = time.perf_counter()
         embeddings = vectorize_text(texts)
-
-        # Определяем путь к папке data
-        data_folder = os.path.join(os.path.dirname(__file__), '..', '..', 'data')
-        path_index = os.path.join(data_folder, 'faiss_index.bin')
-        metadata_path = os.path.join(data_folder, 'metadata.pkl')
-
-        # Создаем индексы faiss и сохраняем метаданные
+        vectorizing_time = time.perf_counter() - vectorizing_started_at
+
+        # Индекс страниц по вводным предложениям первого фрагмента каждой страницы
+        pages = None
+        if args.hierarchical:
+            logging.info("Создаем индекс страниц")
+            with stage("page_index"):
+                offsets = PageIndex.page_offsets(metadata.page_ids)
+                leads = [extract_lead(texts[start], args.lead_length) for start in offsets[:-1]]
+                pages = PageIndex.build(metadata.page_ids, leads, vectorize_text(leads))
+
+        # Создаем индекс faiss и публикуем его вместе с метаданными как новую версию
         index = create_faiss_index(embeddings)
-        save_faiss_index_and_metadata(index=index, texts=texts, index_path=path_index, metadata_path=metadata_path)
-
-        logging.info("Индекс FAISS успешно создан и сохранен.")
+        version = publish_index_bundle(index, metadata, {
+            "model": {"name": MODEL_NAME, "revision": MODEL_REVISION},
+            "chunking": {
+                "min_text_length": MIN_TEXT_LENGTH,
+                "max_chunk_length": max_length,
+                "near_duplicate_threshold": NEAR_DUPLICATE_THRESHOLD,
+                "lead_length": args.lead_length if args.hierarchical else None,
+            },
+            "stats": {
+                "source_rows": source_rows,
+                "chunks": len(texts),
+                "pages": int(len(set(metadata.page_ids.tolist()))),
+                "near_duplicates": df.attrs.get("near_duplicates"),
+                "processing_seconds": round(processing_time, 3),
+                "vectorizing_seconds": round(vectorizing_time, 3),
+                "total_seconds": round(time.perf_counter() - started_at, 3),
+            },
+        }, pages=pages)
+
+        logging.info(f"Индекс FAISS успешно создан и опубликован, версия {version}.")
 
     except Exception as e:
         logging.error(f"Критическая ошибка в процессе: {str(e)}", exc_info=True)
@@ -1,8 +1,12 @@
+import numpy as np
 import pandas as pd
 import re
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
 from src.indexing_service.load_and_save import load_data, save_data_to_csv
 from src.indexing_service.analysis import analyze_data
 from joblib import Parallel, delayed
+from src.shared.profiling import profiled, stage
 import logging
 
 # Создаем логгер для текущего модуля
@@ -15,6 +19,7 @@ def clean_text(text):
     return re.sub(r"[^\w\s.,—'\"«»]", "", text)
 
 
+@profiled
 def filter_dataframe_by_text_length(df: pd.DataFrame, column: str = 'text', min_text_length: int = 3) -> pd.DataFrame:
     """
     Функция для фильтрации строк DataFrame на основе длины текста в указанной колонке с логированием.
@@ -50,8 +55,19 @@ def filter_dataframe_by_text_length(df: pd.DataFrame, column: str = 'text', min_
     return filtered_df
 
 
+# Разделитель фрагментов в тексте страницы
+PARAGRAPH_SEPARATOR = ". "
+
+
+def flatten(lists: pd.Series) -> list:
+    """Объединяет списки группы в один список."""
+    return [item for values in lists for item in values]
+
+
 # Загрузка и предобработка данных
-def process_data(df: pd.DataFrame, column: str = 'text', min_text_length=3) -> pd.DataFrame:
+@profiled
+def process_data(df: pd.DataFrame, column: str = 'text', min_text_length=3, max_length=20000,
+                 near_duplicate_threshold: float | None = 0.9) -> pd.DataFrame:
 
     # Проверка кодировки и битых символов
     df = check_and_fix_utf8_validity(df, column=column)
@@ -61,32 +77,54 @@ def process_data(df: pd.DataFrame, column: str = 'text', min_text_length=3) -> p
     # Фильтрации строк DataFrame на основе длины текста
     df = filter_dataframe_by_text_length(df, column=column, min_text_length=min_text_length)
 
+    # Фрагменты очищаются до объединения, чтобы их позиции в тексте страницы были известны
+    logger.info("Очистка текста")
+    with stage("clean_text"):
+        df = df.assign(text=Parallel(n_jobs=-1)(
+            delayed(clean_text)(text) for text in df["text"].astype(str)
+        ))
+
+    # uid фрагмента хранится списком: к нему добавляются uid удаленных почти дубликатов
+    df = df.assign(source_uids=[[uid] for uid in df["uid"]])
+
+    # Удаление почти дубликатов среди исходных фрагментов
+    if near_duplicate_threshold is not None:
+        df = remove_near_duplicates(df, threshold=near_duplicate_threshold, merge_column="source_uids")
+    near_duplicates = df.attrs.get("near_duplicates")
+
     logger.info("Группировка по ru_wiki_pageid")
-    grouped_df = df.groupby("ru_wiki_pageid").agg(
-        text=("text", lambda x: ". ".join(x.astype(str)))
-    ).reset_index(drop=True)
+    # ru_wiki_pageid и исходные uid фрагментов сохраняются как метаданные чанков,
+    # позиции начала фрагментов (по одной на uid) - для распределения uid по частям страницы
+    with stage("group_by_page"):
+        lengths = df["text"].str.len() + len(PARAGRAPH_SEPARATOR)
+        offsets = lengths.groupby(df["ru_wiki_pageid"]).cumsum() - lengths
+        df = df.assign(source_offsets=[[offset] * len(uids) for offset, uids in zip(offsets, df["source_uids"])])
+        grouped_df = df.groupby("ru_wiki_pageid").agg(
+            text=("text", lambda x: PARAGRAPH_SEPARATOR.join(x)),
+            source_uids=("source_uids", flatten),
+            source_offsets=("source_offsets", flatten)
+        ).reset_index()
 
-    logger.info("Очистка текста")
-    grouped_df["text"] = Parallel(n_jobs=-1)(
-        delayed(clean_text)(text) for text in grouped_df["text"]
-    )
     logger.info("Создание новых uid")
     grouped_df["uid"] = range(len(grouped_df))
 
     # Разбиение длинных текстов
-    grouped_df = process_dataframe(grouped_df)
+    grouped_df = process_dataframe(grouped_df, max_length=max_length)
 
     # Проверка дубликатов
     grouped_df = check_for_duplicates(grouped_df)
 
     logger.info("Создание новых uid")
     grouped_df["uid"] = range(len(grouped_df))
+    if near_duplicates is not None:
+        grouped_df.attrs["near_duplicates"] = near_duplicates
 
     logger.info("Обработка данных завершена")
     return grouped_df
 
 
 # Проверка дубликатов
+@profiled
 def check_for_duplicates(data: pd.DataFrame) -> pd.DataFrame:
     """Проверка и удаление дубликатов."""
     logger.info("Проверка дубликатов")
@@ -102,49 +140,321 @@ def check_for_duplicates(data: pd.DataFrame) -> pd.DataFrame:
     return data
 
 
-def split_text_by_sentences(text: str, max_length: int = 20000) -> list[str]:
+# Параметры MinHash
+MINHASH_PRIME_BASE = np.uint64(0x100000001B3)
+MINHASH_MAX_BATCH_SHINGLES = 1 << 16
+
+
+def _minhash_batch(texts: list[str], a: np.ndarray, b: np.ndarray, shingle_size: int) -> np.ndarray:
+    """
+    Вычисляет MinHash-сигнатуры пачки текстов по символьным шинглам.
+
+    Хэши всех шинглов пачки и их перестановки считаются векторно по
+    склеенному массиву кодов символов, минимум берется по каждому тексту.
+
+    :param texts: Тексты пачки
+    :param a: Нечетные множители хэш-функций перестановок (uint64)
+    :param b: Сдвиги хэш-функций перестановок (uint64)
+    :param shingle_size: Длина шингла в символах
+    :return: Массив сигнатур формы (len(texts), len(a)), uint32
+    """
+    # Короткие тексты дополняются пробелами до одного шингла
+    texts = [text.lower().ljust(shingle_size) for text in texts]
+    lengths = np.fromiter((len(text) for text in texts), dtype=np.int64, count=len(texts))
+    codes = np.frombuffer("".join(texts).encode('utf-32-le'), dtype=np.uint32).astype(np.uint64)
+
+    # Позиции начала всех шинглов, не пересекающих границы текстов
+    starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+    counts = lengths - shingle_size + 1
+    offsets = np.concatenate(([0], np.cumsum(counts)))
+    positions = np.repeat(starts - offsets[:-1], counts) + np.arange(offsets[-1])
+
+    # Полиномиальный хэш шингла и перемешивание битов
+    hashes = np.zeros(len(positions), dtype=np.uint64)
+    for j in range(shingle_size):
+        hashes = hashes * MINHASH_PRIME_BASE + codes[positions + j]
+    hashes ^= hashes >> np.uint64(29)
+    hashes *= np.uint64(0xBF58476D1CE4E5B9)
+    hashes ^= hashes >> np.uint64(32)
+
+    # Перестановки вида (a * h + b) >> 32 и минимум по шинглам каждого текста
+    permuted = (a[:, None] * hashes[None, :] + b[:, None]) >> np.uint64(32)
+    return np.minimum.reduceat(permuted, offsets[:-1], axis=1).T.astype(np.uint32)
+
+
+@profiled
+def compute_minhash_signatures(texts: list[str], num_perm: int = 128, shingle_size: int = 5,
+                               seed: int = 1, n_jobs: int = -1) -> np.ndarray:
+    """
+    Вычисляет MinHash-сигнатуры текстов пачками.
+
+    :param texts: Список текстов
+    :param num_perm: Число хэш-функций (длина сигнатуры)
+    :param shingle_size: Длина символьного шингла
+    :param seed: Зерно генератора хэш-функций
+    :param n_jobs: Число параллельных процессов для joblib
+    :return: Массив сигнатур формы (len(texts), num_perm), uint32
+    """
+    rng = np.random.default_rng(seed)
+    a = rng.integers(1, 2 ** 63, size=num_perm, dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+    b = rng.integers(0, 2 ** 63, size=num_perm, dtype=np.uint64)
+
+    # Пачки ограничены числом шинглов, чтобы матрица перестановок помещалась в память
+    batches, batch, batch_shingles = [], [], 0
+    for text in texts:
+        shingles = max(len(text) - shingle_size + 1, 1)
+        if batch and batch_shingles + shingles > MINHASH_MAX_BATCH_SHINGLES:
+            batches.append(batch)
+            batch, batch_shingles = [], 0
+        batch.append(text)
+        batch_shingles += shingles
+    if batch:
+        batches.append(batch)
+
+    signatures = Parallel(n_jobs=n_jobs)(
+        delayed(_minhash_batch)(batch, a, b, shingle_size) for batch in batches
+    )
+    return np.concatenate(signatures) if signatures else np.empty((0, num_perm), dtype=np.uint32)
+
+
+def choose_lsh_bands(num_perm: int, threshold: float) -> tuple[int, int]:
+    """
+    Подбирает число полос LSH и строк в полосе под порог сходства.
+
+    Вероятность попасть в одну корзину резко растет около (1 / bands) ** (1 / rows),
+    поэтому выбирается разбиение num_perm = bands * rows с этим значением,
+    ближайшим к порогу.
+
+    :param num_perm: Длина сигнатуры
+    :param threshold: Порог сходства Жаккара
+    :return: Кортеж (bands, rows)
+    """
+    pairs = [(num_perm // rows, rows) for rows in range(1, num_perm + 1) if num_perm % rows == 0]
+    return min(pairs, key=lambda pair: abs((1 / pair[0]) ** (1 / pair[1]) - threshold))
+
+
+@profiled
+def find_near_duplicate_clusters(signatures: np.ndarray, threshold: float = 0.9,
+                                 bands: int | None = None) -> np.ndarray:
+    """
+    Находит кластеры почти дубликатов по MinHash-сигнатурам с помощью LSH.
+
+    Тексты, совпавшие хотя бы в одной полосе сигнатуры, становятся кандидатами;
+    пара кандидатов связывается, если оценка сходства Жаккара не ниже порога.
+    Кластеры - компоненты связности графа связанных пар.
+
+    :param signatures: Сигнатуры формы (n, num_perm)
+    :param threshold: Порог сходства Жаккара
+    :param bands: Число полос LSH (по умолчанию подбирается под порог)
+    :return: Метки кластеров для каждого текста
+    """
+    n, num_perm = signatures.shape
+    if bands is None:
+        bands, rows = choose_lsh_bands(num_perm, threshold)
+    else:
+        rows = num_perm // bands
+
+    rng = np.random.default_rng(0)
+    coefficients = rng.integers(1, 2 ** 63, size=rows, dtype=np.uint64)
+
+    # Кандидаты: каждый текст корзины связывается с первым текстом этой корзины
+    candidates = []
+    for band in range(bands):
+        keys = signatures[:, band * rows:(band + 1) * rows].astype(np.uint64) @ coefficients
+        order = np.argsort(keys, kind='stable')
+        sorted_keys = keys[order]
+        is_head = np.concatenate(([True], sorted_keys[1:] != sorted_keys[:-1]))
+        heads = order[np.flatnonzero(is_head)[np.cumsum(is_head) - 1]]
+        members = ~is_head
+        candidates.append(heads[members] * n + order[members])
+
+    pairs = np.unique(np.concatenate(candidates)) if candidates else np.empty(0, dtype=np.int64)
+    left, right = pairs // n, pairs % n
+
+    # Проверка кандидатов по доле совпавших значений сигнатуры
+    similar = np.zeros(len(pairs), dtype=bool)
+    step = max(1, (1 << 24) // max(num_perm, 1))
+    for start in range(0, len(pairs), step):
+        part = slice(start, start + step)
+        similar[part] = (signatures[left[part]] == signatures[right[part]]).mean(axis=1) >= threshold
+    left, right = left[similar], right[similar]
+
+    graph = coo_matrix((np.ones(len(left), dtype=np.int8), (left, right)), shape=(n, n))
+    _, labels = connected_components(graph, directed=False)
+    return labels
+
+
+@profiled
+def remove_near_duplicates(df: pd.DataFrame, column: str = 'text', threshold: float = 0.9,
+                           num_perm: int = 128, shingle_size: int = 5, n_jobs: int = -1,
+                           merge_column: str | None = None) -> pd.DataFrame:
+    """
+    Удаляет почти дубликаты текстов (MinHash + LSH), оставляя первый текст каждого кластера.
+
+    Отчет (число кластеров, удаленные строки, сокращение корпуса) пишется в лог
+    и сохраняется в df.attrs["near_duplicates"]. Списки из колонки merge_column
+    удаленных строк добавляются к списку оставленной строки кластера, чтобы
+    не терять, например, uid исходных фрагментов.
+
+    :param df: DataFrame с текстами
+    :param column: Название колонки с текстом
+    :param threshold: Порог сходства Жаккара по шинглам
+    :param num_perm: Длина MinHash-сигнатуры
+    :param shingle_size: Длина символьного шингла
+    :param n_jobs: Число параллельных процессов для вычисления сигнатур
+    :param merge_column: Колонка со списками, объединяемыми внутри кластера
+    :return: DataFrame без почти дубликатов
+    """
+    logger.info("Поиск почти дубликатов: порог %.2f, сигнатура %d, шингл %d", threshold, num_perm, shingle_size)
+    if df.empty:
+        return df
+
+    signatures = compute_minhash_signatures(df[column].astype(str).tolist(), num_perm=num_perm,
+                                            shingle_size=shingle_size, n_jobs=n_jobs)
+    labels = find_near_duplicate_clusters(signatures, threshold=threshold)
+
+    _, first, inverse, sizes = np.unique(labels, return_index=True, return_inverse=True, return_counts=True)
+    keep = np.zeros(len(df), dtype=bool)
+    keep[first] = True
+
+    clusters = sizes[sizes > 1]
+    report = {
+        "threshold": threshold,
+        "rows_before": len(df),
+        "rows_after": int(keep.sum()),
+        "removed": int((~keep).sum()),
+        "reduction": float((~keep).sum() / len(df)),
+        "clusters": int(len(clusters)),
+        "rows_in_clusters": int(clusters.sum()),
+        "largest_clusters": sorted(clusters.tolist(), reverse=True)[:10],
+    }
+    logger.info(
+        "Почти дубликаты: %d кластеров (%d строк), удалено %d строк из %d (%.2f%%), крупнейшие кластеры: %s",
+        report["clusters"], report["rows_in_clusters"], report["removed"], report["rows_before"],
+        100 * report["reduction"], report["largest_clusters"]
+    )
+    if report["removed"]:
+        logger.debug("Примеры почти дубликатов:\n%s", df[~keep].head())
+
+    cleaned = df[keep].reset_index(drop=True)
+    if merge_column is not None:
+        values = df[merge_column].tolist()
+        for row in np.flatnonzero(~keep):
+            head = first[inverse[row]]
+            values[head] = values[head] + values[row]
+        cleaned[merge_column] = [values[row] for row in np.flatnonzero(keep)]
+    cleaned.attrs["near_duplicates"] = report
+    return cleaned
+
+
+def split_text_spans(text: str, max_length: int = 20000) -> list[tuple[int, int]]:
     """
     Разбивает текст на части по предложениям с учетом ограничения максимальной длины.
 
     :param text: Длинный текст для разбиения.
     :param max_length: Максимальная длина чанка. По умолчанию 20000 символов.
-    :return: Список строк, содержащих части текста.
+    :return: Список границ (start, end) частей в исходном тексте.
     """
 
     if not text:
         return []
 
-    sentences = re.split(r"(?<=[.!?])\s+", text)
+    # Границы предложений: текст между пробелами после знаков конца предложения
+    sentences, start = [], 0
+    for gap in re.finditer(r"(?<=[.!?])\s+", text):
+        sentences.append((start, gap.start()))
+        start = gap.end()
+    sentences.append((start, len(text)))
 
     # Нахождение оптимального размера чанка (среднее значение близкое, но не более max_length)
     max_optim_length = len(text)//(len(text)//max_length + 1)
-    chunks, current_chunk = [], ""
-
-    for sentence in sentences:
-        if len(current_chunk) + len(sentence) + 1 <= max_optim_length:
-            current_chunk += f"{sentence} "
+    spans, chunk_start, chunk_end, chunk_length = [], 0, 0, 0
+
+    for start, end in sentences:
+        if end == start:
+            continue
+        if chunk_length and chunk_length + (end - start) + 1 <= max_optim_length:
+            chunk_end = end
+            chunk_length += end - start + 1
         else:
-            if current_chunk:
-                chunks.append(current_chunk.strip())
-            current_chunk = f"{sentence} "
-    if current_chunk:
-        chunks.append(current_chunk.strip())
-    return chunks
+            if chunk_length:
+                spans.append((chunk_start, chunk_end))
+            chunk_start, chunk_end, chunk_length = start, end, end - start + 1
+    if chunk_length:
+        spans.append((chunk_start, chunk_end))
+    return spans
+
+
+def split_text_by_sentences(text: str, max_length: int = 20000) -> list[str]:
+    """
+    Разбивает текст на части по предложениям с учетом ограничения максимальной длины.
+
+    :param text: Длинный текст для разбиения.
+    :param max_length: Максимальная длина чанка. По умолчанию 20000 символов.
+    :return: Список строк, содержащих части текста.
+    """
+    return [text[start:end] for start, end in split_text_spans(text, max_length)]
+
+
+def chunk_source_uids(uids: list, offsets: list[int], text_length: int,
+                      spans: list[tuple[int, int]]) -> list[list]:
+    """
+    Распределяет uid исходных фрагментов по частям текста страницы.
+
+    Часть получает uid фрагментов, текст которых в нее попадает.
+
+    :param uids: uid фрагментов страницы
+    :param offsets: Позиции начала фрагментов в тексте страницы (по одной на uid)
+    :param text_length: Длина текста страницы
+    :param spans: Границы (start, end) частей
+    :return: Список uid для каждой части
+    """
+    offsets = np.asarray(offsets, dtype=np.int64)
+    # Фрагмент заканчивается там, где начинается следующий
+    bounds = np.unique(offsets)
+    ends = np.append(bounds[1:], text_length)[np.searchsorted(bounds, offsets)]
+    return [[uid for uid, hit in zip(uids, (offsets < end) & (ends > start)) if hit] for start, end in spans]
+
+
+def extract_lead(text: str, max_length: int = 300) -> str:
+    """
+    Возвращает вводные предложения текста общей длиной не более max_length.
+
+    :param text: Текст страницы
+    :param max_length: Максимальная длина результата. По умолчанию 300 символов.
+    :return: Вводные предложения (или начало первого предложения, если оно длиннее max_length)
+    """
+    lead = ""
+    for sentence in re.split(r"(?<=[.!?])\s+", text):
+        if lead and len(lead) + len(sentence) + 1 > max_length:
+            break
+        lead = f"{lead} {sentence}" if lead else sentence
+    return lead[:max_length]
 
 
 # Параллельное разбиение текста
+@profiled
 def process_dataframe(df, max_length=20000):
     """Разбиение длинных текстов на части."""
     logger.info(f"Разбиение текстов длиннее {max_length} символов")
 
     result = []
     for _, row in df.iterrows():
-        if len(row["text"]) > max_length:
-            chunks = split_text_by_sentences(row["text"], max_length)
-            for i, chunk in enumerate(chunks):
-                result.append({"uid": row["uid"], "text": chunk})
+        # Части текста наследуют метаданные исходной строки, а uid фрагментов - только попавших в часть
+        record = row.to_dict()
+        offsets = record.pop("source_offsets", None)
+        text = row["text"]
+        if len(text) > max_length:
+            spans = split_text_spans(text, max_length)
+            uids = (chunk_source_uids(record["source_uids"], offsets, len(text), spans)
+                    if offsets is not None else None)
+            for i, (start, end) in enumerate(spans):
+                chunk = {**record, "text": text[start:end]}
+                if uids is not None:
+                    chunk["source_uids"] = uids[i]
+                result.append(chunk)
         else:
-            result.append({"uid": row["uid"], "text": row["text"]})
+            result.append(record)
 
     new_df = pd.DataFrame(result)
     new_df["uid"] = range(len(new_df))  # Обновление uid
@@ -152,6 +462,7 @@ def process_dataframe(df, max_length=20000):
     return new_df
 
 
+@profiled
 def check_and_fix_utf8_validity(df: pd.DataFrame, column: str) -> pd.DataFrame:
     """
     Проверка и исправление валидности UTF-8 в указанной колонке DataFrame.
@@ -205,6 +516,7 @@ def check_and_fix_utf8_validity(df: pd.DataFrame, column: str) -> pd.DataFrame:
     return df
 
 
+@profiled
 def check_and_fix_replacement_chars(df, column: str):
     """
     Проверка и исправление символов замены.
@@ -235,6 +547,7 @@ def check_and_fix_replacement_chars(df, column: str):
 
 
 
+@profiled
 def check_and_del_non_printable_chars(df: pd.DataFrame, column: str) -> pd.DataFrame:
     """
     Проверка и удаление непечатаемых символов в указанной колонке DataFrame.
@@ -1,45 +1,48 @@
-from sentence_transformers import SentenceTransformer
 import faiss
 import numpy as np
 import logging
 import pickle
 import os
 from typing import List, Tuple, Optional, Any
+from src.shared.embeddings import encode
+from src.shared.bundles import INDEX_FILE, METADATA_FILE, publish_bundle
+from src.shared.hierarchy import PageIndex
+from src.shared.metadata import ChunkMetadata
+from src.shared.profiling import profiled, stage
 
 logger = logging.getLogger(__name__)
 
-# Глобальная переменная для модели
-_MODEL: Optional[SentenceTransformer] = None
+# Размер батча модели и число текстов, кодируемых за один вызов
+BATCH_SIZE = 32
+BLOCK_SIZE = BATCH_SIZE * 64
 
 
-def get_model() -> SentenceTransformer:
-    """Получает или создает экземпляр модели."""
-    global _MODEL
-    if _MODEL is None:
-        logger.info("Загрузка модели SentenceTransformer...")
-        _MODEL = SentenceTransformer('paraphrase-multilingual-MiniLM-L12-v2')
-    return _MODEL
-
-
-def vectorize_text(texts: List[str]) -> np.ndarray:
+@profiled
+def vectorize_text(texts: List[str], block_size: int = BLOCK_SIZE) -> np.ndarray:
     """
     Векторизует тексты с использованием SentenceTransformer.
 
+    Эмбеддинги уже встречавшихся текстов берутся из общего дискового кэша.
+    Тексты кодируются блоками по block_size: закодированные блоки сразу
+    попадают в кэш, а время каждого блока видно в отчете профилирования.
+
     Args:
         texts: Список текстов для векторизации
+        block_size: Число текстов в одном блоке
 
     Returns:
         np.ndarray: Массив эмбеддингов
     """
     try:
-        model = get_model()
         logger.info(f"Кодирование {len(texts)} текстов...")
-        embeddings = model.encode(
-            texts,
-            batch_size=32,
-            show_progress_bar=True,
-            convert_to_numpy=True
-        )
+        if not texts:
+            return encode(texts, batch_size=BATCH_SIZE)
+        blocks = []
+        for start in range(0, len(texts), block_size):
+            with stage("batch"):
+                blocks.append(encode(texts[start:start + block_size], batch_size=BATCH_SIZE))
+            logger.info(f"Кодировано {min(start + block_size, len(texts))} из {len(texts)} текстов")
+        embeddings = np.concatenate(blocks)
         logger.info(f"Успешно кодировано {len(texts)} текстов.")
         return embeddings
     except Exception as e:
@@ -47,6 +50,7 @@ def vectorize_text(texts: List[str]) -> np.ndarray:
         raise
 
 
+@profiled
 def create_faiss_index(embeddings: np.ndarray) -> faiss.Index:
     """
     Создает индекс FAISS из эмбеддингов.
@@ -80,7 +84,7 @@ def create_faiss_index(embeddings: np.ndarray) -> faiss.Index:
 
 def save_faiss_index_and_metadata(
         index: faiss.Index,
-        texts: List[str],
+        metadata: ChunkMetadata,
         index_path: str,
         metadata_path: str
 ) -> None:
@@ -89,7 +93,7 @@ def save_faiss_index_and_metadata(
 
     Args:
         index: Индекс FAISS для сохранения
-        texts: Список текстовых метаданных
+        metadata: Метаданные чанков (текст, страница, исходные uid)
         index_path: Путь для сохранения индекса
         metadata_path: Путь для сохранения метаданных
     """
@@ -99,7 +103,7 @@ def save_faiss_index_and_metadata(
         os.makedirs(os.path.dirname(metadata_path), exist_ok=True)
 
         # Проверка соответствия размеров
-        if len(texts) != index.ntotal:
+        if len(metadata) != index.ntotal:
             raise ValueError("Количество текстов не соответствует количеству векторов в индексе")
 
         logger.info(f"Сохранение индекса в {index_path}")
@@ -107,9 +111,47 @@ def save_faiss_index_and_metadata(
 
         logger.info(f"Сохранение метаданных в {metadata_path}")
         with open(metadata_path, 'wb') as f:
-            pickle.dump(texts, f)
+            pickle.dump(metadata.to_columns(), f)
 
         logger.info("Индекс и метаданные успешно сохранены")
     except Exception as e:
         logger.error(f"Ошибка сохранения индекса и метаданных: {str(e)}", exc_info=True)
-        raise
\ No newline at end of file
+        raise
+
+
+@profiled
+def publish_index_bundle(
+        index: faiss.Index,
+        metadata: ChunkMetadata,
+        manifest: dict,
+        pages: Optional[PageIndex] = None
+) -> str:
+    """
+    Публикует индекс FAISS и метаданные как новую неизменяемую версию.
+
+    Args:
+        index: Индекс FAISS
+        metadata: Метаданные чанков
+        manifest: Описание версии (модель, параметры разбиения, статистика сборки)
+        pages: Индекс уровня страниц для двухуровневого поиска
+
+    Returns:
+        str: Идентификатор опубликованной версии
+    """
+    def write_files(folder: str) -> None:
+        save_faiss_index_and_metadata(
+            index=index,
+            metadata=metadata,
+            index_path=os.path.join(folder, INDEX_FILE),
+            metadata_path=os.path.join(folder, METADATA_FILE)
+        )
+        if pages is not None:
+            pages.save(folder)
+
+    return publish_bundle(write_files, {
+        **manifest,
+        "retrieval": "hierarchical" if pages is not None else "flat",
+        "ntotal": int(index.ntotal),
+        "page_index_size": len(pages) if pages is not None else None,
+        "dimension": int(index.d),
+    })
@@ -0,0 +1,299 @@
+import logging
+import math
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Deque, Dict, Iterator, Optional
+
+logger = logging.getLogger(__name__)
+
+# Полосы очереди в порядке убывания приоритета
+PRIORITIES = ("interactive", "batch")
+
+# Число одновременно выполняемых генераций и размеры очередей по полосам
+MAX_CONCURRENCY = int(os.getenv("QUERY_MAX_CONCURRENCY", "2"))
+QUEUE_LIMITS = {
+    "interactive": int(os.getenv("QUERY_QUEUE_LIMIT_INTERACTIVE", "32")),
+    "batch": int(os.getenv("QUERY_QUEUE_LIMIT_BATCH", "8")),
+}
+
+# Число запросов, одновременно занимающих потоки пула (выполняемые, ожидающие в очередях
+# и присоединившиеся к чужой генерации); сверх него запросы отклоняются до занятия потока
+REQUEST_LIMIT = int(os.getenv("QUERY_REQUEST_LIMIT", str(MAX_CONCURRENCY + sum(QUEUE_LIMITS.values()))))
+
+# Дедлайн запроса по умолчанию, секунды
+DEFAULT_TIMEOUT = float(os.getenv("QUERY_DEFAULT_TIMEOUT", "600"))
+
+# Число последних времен ожидания для расчета перцентилей
+WAIT_WINDOW = 1000
+
+
+class AdmissionError(Exception):
+    """Запрос не может быть принят или выполнен в отведенное время."""
+
+    status_code = 503
+
+    def __init__(self, message: str, retry_after: int = 1):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class QueueFullError(AdmissionError):
+    """Очередь полосы заполнена."""
+
+    status_code = 429
+
+
+class DeadlineExceededError(AdmissionError):
+    """Запрос не успевает выполниться до своего дедлайна."""
+
+    status_code = 503
+
+
+class Deadline:
+    """Момент времени, к которому запрос должен быть выполнен."""
+
+    def __init__(self, timeout: Optional[float] = None):
+        self._expires_at = time.monotonic() + (DEFAULT_TIMEOUT if timeout is None else timeout)
+
+    def remaining(self) -> float:
+        """Оставшееся до дедлайна время в секундах (не меньше нуля)."""
+        return max(0.0, self._expires_at - time.monotonic())
+
+    def expired(self) -> bool:
+        """Проверяет, истек ли дедлайн."""
+        return self.remaining() <= 0
+
+    def extend(self, other: "Deadline") -> None:
+        """Сдвигает дедлайн до более позднего из двух."""
+        self._expires_at = max(self._expires_at, other._expires_at)
+
+    def copy(self) -> "Deadline":
+        """Возвращает независимую копию дедлайна."""
+        deadline = Deadline(0)
+        deadline._expires_at = self._expires_at
+        return deadline
+
+    def check(self, stage: str) -> None:
+        """
+        Прерывает обработку, если дедлайн истек до начала этапа.
+
+        Args:
+            stage: Название этапа для сообщения об ошибке
+
+        Raises:
+            DeadlineExceededError: Если дедлайн уже истек
+        """
+        if self.expired():
+            logger.warning(f"Дедлайн истек перед этапом '{stage}', запрос отброшен")
+            raise DeadlineExceededError(f"Дедлайн запроса истек перед этапом '{stage}'")
+
+
+class AdmissionController:
+    """
+    Контроль допуска запросов к дорогим этапам обработки.
+
+    Одновременно выполняется не более max_concurrency запросов, остальные
+    ждут в ограниченных очередях по полосам приоритета. Освободившийся слот
+    получает самый старый запрос из самой приоритетной непустой полосы.
+    Запросы, которые заведомо не успеют дождаться слота до своего дедлайна,
+    а также запросы в заполненную полосу отклоняются сразу.
+
+    Число запросов в обработке дополнительно ограничено request_limit:
+    enter_request() вызывается до того, как запрос займет поток пула,
+    и не блокируется, поэтому при перегрузке отказ 429 приходит сразу,
+    а не после ожидания свободного потока.
+    """
+
+    def __init__(self, max_concurrency: int = MAX_CONCURRENCY, queue_limits: Optional[Dict[str, int]] = None,
+                 request_limit: Optional[int] = None):
+        self._max_concurrency = max(1, max_concurrency)
+        self._queue_limits = dict(queue_limits or QUEUE_LIMITS)
+        self._request_limit = REQUEST_LIMIT if request_limit is None else request_limit
+        self._cond = threading.Condition()
+        self._active = 0
+        self._requests = 0
+        self._queues: Dict[str, Deque[object]] = {priority: deque() for priority in self._queue_limits}
+        # Порядок обслуживания полос: сначала известные приоритеты, затем остальные
+        self._order = sorted(self._queues, key=lambda p: PRIORITIES.index(p) if p in PRIORITIES else len(PRIORITIES))
+        # Экспоненциальное скользящее среднее времени обслуживания
+        self._service_time: Optional[float] = None
+
+        self._admitted = {priority: 0 for priority in self._queue_limits}
+        self._rejected_full = {priority: 0 for priority in self._queue_limits}
+        self._rejected_deadline = {priority: 0 for priority in self._queue_limits}
+        self._waits: Dict[str, Deque[float]] = {priority: deque(maxlen=WAIT_WINDOW) for priority in self._queue_limits}
+        self._max_wait = {priority: 0.0 for priority in self._queue_limits}
+
+    def _lanes_ahead(self, priority: str):
+        """Полосы, запросы из которых обслуживаются не позже полосы priority."""
+        return self._order[:self._order.index(priority) + 1]
+
+    def _next_ticket(self) -> Optional[object]:
+        """Запрос, который получит следующий освободившийся слот."""
+        for priority in self._order:
+            if self._queues[priority]:
+                return self._queues[priority][0]
+        return None
+
+    def _estimated_wait(self, priority: str) -> float:
+        """Оценка времени ожидания слота для нового запроса полосы priority."""
+        ahead = sum(len(self._queues[p]) for p in self._lanes_ahead(priority))
+        if self._active < self._max_concurrency and ahead == 0:
+            return 0.0
+        return (ahead // self._max_concurrency + 1) * (self._service_time or 0.0)
+
+    def _retry_after(self) -> int:
+        """Рекомендуемая задержка перед повтором запроса, секунды."""
+        queued = sum(len(queue) for queue in self._queues.values())
+        estimate = (queued / self._max_concurrency + 1) * (self._service_time or 1.0)
+        return max(1, math.ceil(estimate))
+
+    def _record_wait(self, priority: str, wait: float) -> None:
+        self._admitted[priority] += 1
+        self._waits[priority].append(wait)
+        self._max_wait[priority] = max(self._max_wait[priority], wait)
+
+    def enter_request(self, priority: str) -> None:
+        """
+        Регистрирует запрос в обработке, не блокируясь.
+
+        Вызывается до того, как запрос займет поток пула.
+
+        Args:
+            priority: Полоса приоритета запроса
+
+        Raises:
+            ValueError: Если полоса приоритета неизвестна
+            QueueFullError: Если достигнут предел запросов в обработке или очередь полосы заполнена
+        """
+        if priority not in self._queues:
+            raise ValueError(f"Неизвестный приоритет: {priority}")
+
+        with self._cond:
+            if self._requests >= self._request_limit or len(self._queues[priority]) >= self._queue_limits[priority]:
+                self._rejected_full[priority] += 1
+                logger.warning(f"Запрос '{priority}' отклонен: в обработке {self._requests} запросов")
+                raise QueueFullError(f"Сервис перегружен, очередь '{priority}' заполнена",
+                                     retry_after=self._retry_after())
+            self._requests += 1
+
+    def leave_request(self) -> None:
+        """Снимает запрос, зарегистрированный enter_request(), с учета."""
+        with self._cond:
+            self._requests -= 1
+
+    @contextmanager
+    def request(self, priority: str) -> Iterator[None]:
+        """Контекстный менеджер для enter_request() и leave_request()."""
+        self.enter_request(priority)
+        try:
+            yield
+        finally:
+            self.leave_request()
+
+    def acquire(self, priority: str, deadline: Deadline) -> None:
+        """
+        Ожидает свободный слот для выполнения запроса.
+
+        Args:
+            priority: Полоса приоритета запроса
+            deadline: Дедлайн запроса
+
+        Raises:
+            ValueError: Если полоса приоритета неизвестна
+            QueueFullError: Если очередь полосы заполнена
+            DeadlineExceededError: Если слот не освободится до дедлайна
+        """
+        if priority not in self._queues:
+            raise ValueError(f"Неизвестный приоритет: {priority}")
+
+        with self._cond:
+            queue = self._queues[priority]
+
+            if self._active < self._max_concurrency and self._next_ticket() is None:
+                self._active += 1
+                self._record_wait(priority, 0.0)
+                return
+
+            if len(queue) >= self._queue_limits[priority]:
+                self._rejected_full[priority] += 1
+                logger.warning(f"Очередь '{priority}' заполнена ({len(queue)}), запрос отклонен")
+                raise QueueFullError(f"Очередь '{priority}' заполнена", retry_after=self._retry_after())
+
+            if self._estimated_wait(priority) > deadline.remaining():
+                self._rejected_deadline[priority] += 1
+                logger.warning(f"Запрос '{priority}' не дождется слота до дедлайна, запрос отклонен")
+                raise DeadlineExceededError("Запрос не успеет выполниться до дедлайна", retry_after=self._retry_after())
+
+            ticket = object()
+            queue.append(ticket)
+            enqueued_at = time.monotonic()
+            try:
+                while not (self._active < self._max_concurrency and self._next_ticket() is ticket):
+                    remaining = deadline.remaining()
+                    if remaining <= 0:
+                        self._rejected_deadline[priority] += 1
+                        logger.warning(f"Дедлайн запроса '{priority}' истек в очереди")
+                        raise DeadlineExceededError("Дедлайн запроса истек в очереди", retry_after=self._retry_after())
+                    self._cond.wait(remaining)
+            except BaseException:
+                queue.remove(ticket)
+                self._cond.notify_all()
+                raise
+
+            queue.popleft()
+            self._active += 1
+            self._record_wait(priority, time.monotonic() - enqueued_at)
+
+    def release(self, service_time: float) -> None:
+        """
+        Освобождает слот и учитывает время обслуживания запроса.
+
+        Args:
+            service_time: Время выполнения запроса в секундах
+        """
+        with self._cond:
+            self._active -= 1
+            if self._service_time is None:
+                self._service_time = service_time
+            else:
+                self._service_time = 0.8 * self._service_time + 0.2 * service_time
+            self._cond.notify_all()
+
+    @contextmanager
+    def slot(self, priority: str, deadline: Deadline) -> Iterator[None]:
+        """Контекстный менеджер, удерживающий слот на время выполнения запроса."""
+        self.acquire(priority, deadline)
+        started_at = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(time.monotonic() - started_at)
+
+    def stats(self) -> Dict[str, object]:
+        """Возвращает глубину очередей, время ожидания и счетчики отказов."""
+        with self._cond:
+            lanes = {}
+            for priority, queue in self._queues.items():
+                waits = sorted(self._waits[priority])
+                lanes[priority] = {
+                    "depth": len(queue),
+                    "limit": self._queue_limits[priority],
+                    "admitted": self._admitted[priority],
+                    "rejected_queue_full": self._rejected_full[priority],
+                    "rejected_deadline": self._rejected_deadline[priority],
+                    "wait_avg": sum(waits) / len(waits) if waits else 0.0,
+                    "wait_p95": waits[min(len(waits) - 1, int(0.95 * len(waits)))] if waits else 0.0,
+                    "wait_max": self._max_wait[priority],
+                }
+            return {
+                "active": self._active,
+                "max_concurrency": self._max_concurrency,
+                "requests": self._requests,
+                "request_limit": self._request_limit,
+                "service_time_avg": self._service_time or 0.0,
+                "lanes": lanes,
+            }
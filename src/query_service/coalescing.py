@@ -0,0 +1,142 @@
+import logging
+import threading
+from typing import Callable, Dict, Hashable, Iterator, List, Optional
+from admission import Deadline, DeadlineExceededError
+
+logger = logging.getLogger(__name__)
+
+
+class InFlightAnswer:
+    """
+    Выполняющаяся генерация ответа, к которой могут присоединяться одинаковые запросы.
+
+    Генерация публикует фрагменты ответа по мере их получения, поэтому каждый
+    подписчик может как дождаться полного ответа, так и читать поток токенов,
+    начиная с самого первого фрагмента.
+    """
+
+    def __init__(self, deadline: Deadline):
+        self._cond = threading.Condition()
+        # Дедлайн генерации - самый поздний из дедлайнов подписчиков
+        self.deadline = deadline.copy()
+        self._chunks: List[str] = []
+        self._done = False
+        self._error: Optional[BaseException] = None
+
+    def publish(self, chunk: str) -> None:
+        """Добавляет очередной фрагмент ответа и будит ожидающих подписчиков."""
+        with self._cond:
+            self._chunks.append(chunk)
+            self._cond.notify_all()
+
+    def finish(self, error: Optional[BaseException] = None) -> None:
+        """Отмечает генерацию завершенной (успешно или с ошибкой)."""
+        with self._cond:
+            self._done = True
+            self._error = error
+            self._cond.notify_all()
+
+    def stream(self, deadline: Optional[Deadline] = None) -> Iterator[str]:
+        """
+        Возвращает фрагменты ответа с самого начала генерации.
+
+        Args:
+            deadline: Дедлайн подписчика, после которого ожидание прекращается
+
+        Yields:
+            str: Очередной фрагмент ответа
+
+        Raises:
+            DeadlineExceededError: Если дедлайн подписчика истек раньше ответа
+            Exception: Ошибка, с которой завершилась генерация
+        """
+        position = 0
+        while True:
+            with self._cond:
+                while position >= len(self._chunks) and not self._done:
+                    if deadline is not None and deadline.expired():
+                        raise DeadlineExceededError("Дедлайн запроса истек в ожидании ответа")
+                    self._cond.wait(deadline.remaining() if deadline is not None else None)
+                chunks = self._chunks[position:]
+                position += len(chunks)
+                done, error = self._done, self._error
+
+            yield from chunks
+
+            if done:
+                if error is not None:
+                    raise error
+                return
+
+    def result(self, deadline: Optional[Deadline] = None) -> str:
+        """Дожидается окончания генерации и возвращает полный ответ."""
+        return "".join(self.stream(deadline))
+
+
+class SingleFlight:
+    """
+    Дедупликация одинаковых одновременных запросов (single-flight).
+
+    Первый запрос с данным ключом запускает генерацию в отдельном потоке,
+    все последующие запросы с тем же ключом, пришедшие до ее окончания,
+    присоединяются к уже выполняющейся генерации.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._in_flight: Dict[Hashable, InFlightAnswer] = {}
+        self._started = 0
+        self._coalesced = 0
+
+    def attach(self, key: Hashable, produce: Callable[[Deadline], Iterator[str]],
+               deadline: Deadline) -> InFlightAnswer:
+        """
+        Присоединяется к генерации с ключом key или запускает новую.
+
+        Присоединившийся запрос продлевает дедлайн генерации до своего.
+
+        Args:
+            key: Ключ запроса (нормализованный вопрос, версия индекса и т.п.)
+            produce: Функция, принимающая дедлайн генерации и возвращающая итератор фрагментов ответа
+            deadline: Дедлайн запроса
+
+        Returns:
+            InFlightAnswer: Генерация, из которой можно получить ответ
+        """
+        with self._lock:
+            entry = self._in_flight.get(key)
+            if entry is not None:
+                entry.deadline.extend(deadline)
+                self._coalesced += 1
+                logger.info(f"Запрос присоединен к выполняющейся генерации (всего объединено: {self._coalesced})")
+                return entry
+
+            entry = InFlightAnswer(deadline)
+            self._in_flight[key] = entry
+            self._started += 1
+
+        threading.Thread(target=self._run, args=(key, entry, produce), daemon=True).start()
+        return entry
+
+    def _run(self, key: Hashable, entry: InFlightAnswer, produce: Callable[[Deadline], Iterator[str]]) -> None:
+        """Выполняет генерацию и публикует ее результат подписчикам."""
+        error: Optional[BaseException] = None
+        try:
+            for chunk in produce(entry.deadline):
+                entry.publish(chunk)
+        except Exception as e:
+            error = e
+        finally:
+            # Новые запросы после завершения должны запускать свежую генерацию
+            with self._lock:
+                self._in_flight.pop(key, None)
+            entry.finish(error)
+
+    def stats(self) -> Dict[str, int]:
+        """Возвращает счетчики запущенных и объединенных запросов."""
+        with self._lock:
+            return {
+                "generations_started": self._started,
+                "requests_coalesced": self._coalesced,
+                "in_flight": len(self._in_flight),
+            }
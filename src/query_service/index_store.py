@@ -0,0 +1,147 @@
+import gc
+import logging
+import os
+import threading
+import time
+from typing import Any, Callable, Optional, Tuple
+
+from src.shared.bundles import (
+    BUNDLES_FOLDER, INDEX_FILE, METADATA_FILE, bundle_path, current_version, load_manifest, verify_bundle
+)
+from src.shared.hierarchy import PageIndex
+
+logger = logging.getLogger(__name__)
+
+# Как часто проверять указатель на текущую версию индекса, секунды
+RELOAD_INTERVAL = float(os.getenv("INDEX_RELOAD_INTERVAL", "5"))
+
+# Проверять ли контрольные суммы версии перед переключением на нее
+VERIFY_CHECKSUMS = os.getenv("INDEX_VERIFY_CHECKSUMS", "1") != "0"
+
+# Префикс версии для индекса, сохраненного файлами вне каталога версий
+LEGACY_VERSION_PREFIX = "legacy:"
+
+# Загруженная версия: (идентификатор версии, индекс, метаданные, индекс страниц или None)
+LoadedIndex = Tuple[str, Any, Any, Optional[PageIndex]]
+
+
+class IndexStore:
+    """
+    Текущая версия индекса с переключением на новые версии без простоя.
+
+    Раз в reload_interval секунд проверяется указатель на текущую
+    опубликованную версию. Новая версия загружается в фоне, пока запросы
+    обслуживает старая, затем ссылка на версию атомарно заменяется.
+    Одновременно загружается не более одной версии, поэтому в памяти
+    находятся не более двух версий: старая освобождается, как только ее
+    перестают использовать выполняющиеся запросы.
+
+    Если опубликованных версий нет, используется индекс, сохраненный
+    файлами index_path и metadata_path (старый формат).
+    """
+
+    def __init__(
+            self,
+            loader: Callable[[str, str], Tuple[Any, Any]],
+            index_path: str,
+            metadata_path: str,
+            bundles_folder: str = BUNDLES_FOLDER,
+            reload_interval: float = RELOAD_INTERVAL,
+            verify_checksums: bool = VERIFY_CHECKSUMS
+    ):
+        self._loader = loader
+        self._index_path = index_path
+        self._metadata_path = metadata_path
+        self._bundles_folder = bundles_folder
+        self._reload_interval = reload_interval
+        self._verify_checksums = verify_checksums
+
+        self._lock = threading.Lock()
+        self._current: Optional[LoadedIndex] = None
+        self._checked_at = 0.0
+        self._loading = False
+        self._failed_version: Optional[str] = None
+
+    def _target_version(self) -> Optional[str]:
+        """Версия, которую следует обслуживать, или None, если индекса нет."""
+        version = current_version(self._bundles_folder)
+        if version is not None:
+            return version
+
+        stats = []
+        for path in (self._index_path, self._metadata_path):
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                return None
+            stats.append(f"{stat.st_mtime_ns}-{stat.st_size}")
+        return LEGACY_VERSION_PREFIX + ":".join(stats)
+
+    def _load(self, version: str) -> LoadedIndex:
+        """Загружает версию индекса, проверяя ее контрольные суммы."""
+        if version.startswith(LEGACY_VERSION_PREFIX):
+            index, metadata = self._loader(self._index_path, self._metadata_path)
+            return version, index, metadata, None
+
+        path = bundle_path(version, self._bundles_folder)
+        manifest = load_manifest(path)
+        if self._verify_checksums:
+            verify_bundle(path, manifest)
+        logger.info(f"Загрузка версии индекса {version} (модель: {manifest.get('model', {}).get('name')})")
+        index, metadata = self._loader(os.path.join(path, INDEX_FILE), os.path.join(path, METADATA_FILE))
+        pages = PageIndex.load(path)
+        if pages is not None and pages.offsets[-1] != len(metadata):
+            raise ValueError("Индекс страниц не соответствует метаданным фрагментов")
+        return version, index, metadata, pages
+
+    def _swap(self, version: str) -> None:
+        """Загружает новую версию в фоне и переключает на нее запросы."""
+        try:
+            loaded = self._load(version)
+            with self._lock:
+                previous, self._current = self._current, loaded
+            logger.info(f"Запросы переключены на версию индекса {version} (предыдущая: {previous and previous[0]})")
+            # Предыдущая версия освобождается, когда ее перестанут использовать выполняющиеся запросы
+            del previous, loaded
+            gc.collect()
+        except Exception as e:
+            logger.error(f"Не удалось загрузить версию индекса {version}, продолжаем обслуживать текущую: {str(e)}",
+                         exc_info=True)
+            with self._lock:
+                self._failed_version = version
+        finally:
+            with self._lock:
+                self._loading = False
+
+    def get(self) -> LoadedIndex:
+        """
+        Возвращает текущую версию индекса.
+
+        Первая загрузка выполняется синхронно, последующие версии
+        подхватываются в фоне без блокировки запросов.
+
+        Returns:
+            LoadedIndex: Идентификатор версии, индекс, метаданные и индекс страниц
+
+        Raises:
+            FileNotFoundError: Если индекс еще не опубликован
+        """
+        with self._lock:
+            current = self._current
+            now = time.monotonic()
+            if current is not None and now - self._checked_at < self._reload_interval:
+                return current
+            self._checked_at = now
+
+            target = self._target_version()
+            if current is None:
+                if target is None:
+                    raise FileNotFoundError(f"Индекс не найден ни в {self._bundles_folder}, ни в {self._index_path}")
+                self._current = self._load(target)
+                return self._current
+
+            if target is not None and target != current[0] and target != self._failed_version and not self._loading:
+                logger.info(f"Обнаружена новая версия индекса {target}, загрузка в фоне")
+                self._loading = True
+                threading.Thread(target=self._swap, args=(target,), daemon=True).start()
+            return current
@@ -1,6 +1,18 @@
-from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel
-from query import answer_question
+import os
+import threading
+import time
+from contextlib import ExitStack, asynccontextmanager
+from typing import Any, Dict, Literal, Optional
+import anyio.to_thread
+from fastapi import FastAPI, Header, HTTPException, Response
+from fastapi.concurrency import iterate_in_threadpool, run_in_threadpool
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
+from pydantic import BaseModel, Field
+from admission import REQUEST_LIMIT, AdmissionError
+from src.shared.metadata import FilterError
+from src.shared.profiling import report_path
+from query import (answer_question, stream_answer, get_coalescing_stats, get_admission_stats, warm_up, is_ready,
+                   profiler_from_header, request_admission)
 import logging
 
 # Настройка логирования
@@ -10,22 +22,149 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-app = FastAPI()
+# Паузы между попытками прогрева, секунды: начальная и максимальная
+WARM_UP_RETRY_INITIAL = float(os.getenv("WARM_UP_RETRY_INITIAL", "1"))
+WARM_UP_RETRY_MAX = float(os.getenv("WARM_UP_RETRY_MAX", "60"))
+
+# Потоки пула сверх предела запросов /query (REQUEST_LIMIT) для остальных синхронных вызовов
+THREADPOOL_RESERVE = int(os.getenv("QUERY_THREADPOOL_RESERVE", "8"))
+
+def run_warm_up():
+    """
+    Прогревает модель и индекс, не прерывая работу сервиса при ошибке.
+
+    Неудачный прогрев (например, индекс еще не опубликован) повторяется
+    с экспоненциально растущей паузой, пока не завершится успешно.
+    """
+    delay = WARM_UP_RETRY_INITIAL
+    while True:
+        try:
+            warm_up()
+            return
+        except Exception as e:
+            logger.error(f"Ошибка прогрева сервиса, повтор через {delay:.0f} с: {str(e)}", exc_info=True)
+        time.sleep(delay)
+        delay = min(delay * 2, WARM_UP_RETRY_MAX)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Прогрев выполняется в фоне: /health отвечает сразу, /ready - после прогрева
+    threading.Thread(target=run_warm_up, daemon=True).start()
+    # Запросы /query занимают не больше REQUEST_LIMIT потоков, поэтому пул никогда не переполняется ими
+    anyio.to_thread.current_default_thread_limiter().total_tokens = REQUEST_LIMIT + THREADPOOL_RESERVE
+    yield
+
+app = FastAPI(lifespan=lifespan)
 
 class QuestionRequest(BaseModel):
     question: str
+    # Полоса очереди: интерактивные запросы обслуживаются раньше пакетных
+    priority: Literal["interactive", "batch"] = "interactive"
+    # Время в секундах, за которое клиенту нужен ответ
+    timeout: Optional[float] = Field(default=None, gt=0)
+    # Фильтр по метаданным чанков, например {"ru_wiki_pageid": {"in": [123, 456]}}
+    filters: Optional[Dict[str, Any]] = None
+    # Двухуровневый поиск (страницы, затем фрагменты); по умолчанию - если он есть в текущей версии индекса
+    hierarchical: Optional[bool] = None
 
+def admission_error_to_http(e: AdmissionError) -> HTTPException:
+    """Преобразует отказ в допуске в быстрый ответ 429/503 с заголовком Retry-After."""
+    logger.warning(f"Запрос отклонен: {str(e)}")
+    return HTTPException(status_code=e.status_code, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+
+# Обработчики асинхронные: запрос учитывается контролем допуска до того, как займет поток пула,
+# и при перегрузке сразу получает 429; ожидание и генерация выполняются в пуле потоков, поэтому
+# одновременные одинаковые вопросы могут присоединяться к одной генерации
+# Заголовок X-Profile включает профилирование запроса ("1", "flamegraph", "memory" или "flamegraph,memory");
+# идентификатор отчета возвращается в заголовке X-Profile-Id, сам отчет - по GET /profiles/{run_id}
 @app.post("/query")
-async def query_endpoint(question_request: QuestionRequest):
+async def query_endpoint(question_request: QuestionRequest, response: Response,
+                         x_profile: Optional[str] = Header(default=None)):
+    profiler = profiler_from_header(x_profile)
+    if profiler is not None:
+        response.headers["X-Profile-Id"] = profiler.run_id
     try:
         logger.info(f"Получен вопрос: {question_request.question}")
-        answer = answer_question(question_request.question)
+        with request_admission(question_request.priority):
+            answer = await run_in_threadpool(
+                answer_question, question_request.question, question_request.priority, question_request.timeout,
+                question_request.filters, question_request.hierarchical, profiler
+            )
         logger.info("Ответ успешно сгенерирован")
         return {"answer": answer}
+    except AdmissionError as e:
+        raise admission_error_to_http(e)
+    except FilterError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.error(f"Ошибка при обработке запроса: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail="Произошла ошибка при обработке вашего запроса.")
 
+@app.post("/query/stream")
+async def query_stream_endpoint(question_request: QuestionRequest, x_profile: Optional[str] = Header(default=None)):
+    logger.info(f"Получен вопрос (потоковый режим): {question_request.question}")
+    profiler = profiler_from_header(x_profile)
+    # Запрос учитывается в обработке до окончания потока
+    admission = ExitStack()
+    try:
+        admission.enter_context(request_admission(question_request.priority))
+    except AdmissionError as e:
+        raise admission_error_to_http(e)
+
+    chunks = stream_answer(question_request.question, question_request.priority, question_request.timeout,
+                           question_request.filters, question_request.hierarchical, profiler)
+    # Дожидаемся первого фрагмента, чтобы отказ в допуске вернуть кодом ответа, а не оборванным потоком
+    try:
+        first = await run_in_threadpool(next, chunks, "")
+    except AdmissionError as e:
+        admission.close()
+        raise admission_error_to_http(e)
+    except FilterError as e:
+        admission.close()
+        raise HTTPException(status_code=400, detail=str(e))
+    except BaseException:
+        admission.close()
+        raise
+
+    async def body():
+        with admission:
+            yield first
+            async for chunk in iterate_in_threadpool(chunks):
+                yield chunk
+
+    headers = {"X-Profile-Id": profiler.run_id} if profiler is not None else None
+    return StreamingResponse(body(), media_type="text/plain; charset=utf-8", headers=headers)
+
+@app.get("/health")
+async def health_endpoint():
+    return {"status": "ok"}
+
+@app.get("/ready")
+async def ready_endpoint():
+    if not is_ready():
+        return JSONResponse(status_code=503, content={"status": "warming_up"})
+    return {"status": "ready"}
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    return {"coalescing": get_coalescing_stats(), "admission": get_admission_stats()}
+
+@app.get("/profiles/{run_id}")
+async def profile_report_endpoint(run_id: str):
+    # Отчет сохраняется по окончании генерации ответа
+    path = report_path(run_id)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Отчет профилирования не найден")
+    return FileResponse(path, media_type="application/json")
+
+@app.get("/profiles/{run_id}/flamegraph")
+async def profile_flamegraph_endpoint(run_id: str):
+    # Свернутые стеки: открываются в speedscope или преобразуются в SVG утилитой flamegraph.pl
+    path = report_path(run_id, suffix=".folded")
+    if path is None:
+        raise HTTPException(status_code=404, detail="Flamegraph для прогона не найден")
+    return FileResponse(path, media_type="text/plain; charset=utf-8")
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -1,38 +1,60 @@
-import faiss
-from sentence_transformers import SentenceTransformer
 import logging
 import requests
 import json
+import math
 import os
-from typing import List, Tuple, Optional
+import re
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+from typing import TYPE_CHECKING, Any, ContextManager, Dict, Iterator, List, Tuple, Optional
 import pickle
+import numpy as np
+from admission import AdmissionController, AdmissionError, Deadline
+from coalescing import SingleFlight
+from index_store import IndexStore
+from src.shared.config import DATA_FOLDER
+from src.shared.embeddings import encode_queries, get_model
+from src.shared.hierarchy import PageIndex
+from src.shared.metadata import ChunkMetadata, Filter, FilterError, parse_filters
+from src.shared.profiling import Profiler, profile_run, profiled, stage
+
+# faiss и sentence_transformers (вместе с torch) импортируются лениво при
+# прогреве или первом запросе, чтобы импорт модуля оставался быстрым
+if TYPE_CHECKING:
+    import faiss
 
-# Настройка логгирования
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler(os.path.join(os.path.dirname(__file__), 'app.log'), encoding='utf-8'),
-        logging.StreamHandler()
-    ]
-)
 logger = logging.getLogger(__name__)
 
-# Глобальная переменная для модели
-_MODEL: Optional[SentenceTransformer] = None
+# Пути к индексу старого формата (используются, если нет опубликованных версий)
+PATH_FAISS = os.path.join(DATA_FOLDER, 'faiss_index.bin')
+PATH_METADATA = os.path.join(DATA_FOLDER, 'metadata.pkl')
 
+# Текущая версия индекса (функция загрузки определена ниже, поэтому передается через lambda)
+_INDEX_STORE = IndexStore(lambda index_path, metadata_path: load_faiss_index_and_metadata(index_path, metadata_path),
+                          PATH_FAISS, PATH_METADATA)
 
-def get_model() -> SentenceTransformer:
-    """Получает или создает экземпляр модели."""
-    global _MODEL
-    if _MODEL is None:
-        logger.info("Загрузка модели SentenceTransformer...")
-        _MODEL = SentenceTransformer('paraphrase-multilingual-MiniLM-L12-v2')
-    return _MODEL
+# Число страниц-кандидатов при двухуровневом поиске
+CANDIDATE_PAGES = int(os.getenv("QUERY_CANDIDATE_PAGES", "20"))
 
+# Разрешено ли профилирование запросов по заголовку X-Profile (по умолчанию выключено:
+# профилирование памяти замедляет весь процесс, а каждый отчет записывается на диск)
+PROFILING_ENABLED = os.getenv("QUERY_PROFILING_ENABLED", "0") == "1"
 
-def load_faiss_index(index_path: str) -> faiss.Index:
+# Готовность сервиса: модель и индекс загружены и прогреты
+_READY = threading.Event()
+
+# Объединение одинаковых одновременных вопросов
+_ANSWERS = SingleFlight()
+
+# Контроль допуска к поиску и генерации
+_ADMISSION = AdmissionController()
+
+
+def load_faiss_index(index_path: str) -> "faiss.Index":
     """Загружает индекс FAISS из файла."""
+    import faiss
+
     try:
         index = faiss.read_index(index_path)
         logger.info(f"Индекс FAISS загружен из {index_path}")
@@ -45,7 +67,7 @@ def load_faiss_index(index_path: str) -> faiss.Index:
         raise
 
 
-def load_faiss_index_and_metadata(index_path: str, metadata_path: str) -> Tuple[faiss.Index, List[str]]:
+def load_faiss_index_and_metadata(index_path: str, metadata_path: str) -> Tuple["faiss.Index", ChunkMetadata]:
     """
     Загружает индекс FAISS и связанные с ним метаданные.
 
@@ -54,37 +76,75 @@ def load_faiss_index_and_metadata(index_path: str, metadata_path: str) -> Tuple[
         metadata_path: Путь к файлу метаданных
 
     Returns:
-        Tuple[faiss.Index, List[str]]: Загруженный индекс и соответствующие метаданные
+        Tuple[faiss.Index, ChunkMetadata]: Загруженный индекс и соответствующие метаданные
     """
+    import faiss
+
     try:
         logger.info(f"Загрузка индекса из {index_path}")
         index = faiss.read_index(index_path)
 
         logger.info(f"Загрузка метаданных из {metadata_path}")
         with open(metadata_path, 'rb') as f:
-            texts = pickle.load(f)
+            metadata = ChunkMetadata.from_columns(pickle.load(f))
 
-        if len(texts) != index.ntotal:
+        if len(metadata) != index.ntotal:
             raise ValueError("Количество текстов не соответствует количеству векторов в индексе")
 
-        logger.info(f"Успешно загружены индекс с {index.ntotal} векторами и {len(texts)} метаданными")
-        return index, texts
+        logger.info(f"Успешно загружены индекс с {index.ntotal} векторами и {len(metadata)} метаданными")
+        return index, metadata
     except Exception as e:
         logger.error(f"Ошибка загрузки индекса и метаданных: {str(e)}", exc_info=True)
         raise
 
 
-def query_index(index: faiss.Index, texts: List[str], query_text: str, model: SentenceTransformer, k: int = 5) -> List[
-    str]:
-    """Запрашивает индекс FAISS и возвращает соответствующие метаданные (тексты)."""
+@profiled
+def query_index(
+        index: "faiss.Index",
+        metadata: ChunkMetadata,
+        query_text: str,
+        k: int = 5,
+        filters: Optional[List[Filter]] = None
+) -> List[str]:
+    """
+    Запрашивает индекс FAISS и возвращает соответствующие метаданные (тексты).
+
+    Фильтр по метаданным применяется внутри поиска FAISS через битовую маску
+    допустимых чанков, поэтому возвращается до k подходящих под фильтр чанков.
+
+    Args:
+        index: Индекс FAISS
+        metadata: Метаданные чанков индекса
+        query_text: Текст запроса
+        k: Число ближайших соседей
+        filters: Нормализованные условия фильтра (см. parse_filters)
+
+    Returns:
+        List[str]: Тексты найденных чанков
+    """
+    import faiss
+
     try:
+        params = None
+        if filters:
+            mask = metadata.mask(filters)
+            logger.info(f"Фильтру соответствует {int(mask.sum())} из {len(metadata)} чанков")
+            if not mask.any():
+                return []
+            # Бит i маски разрешает вектор i; маска должна жить до окончания поиска
+            bitmap = np.packbits(mask, bitorder='little')
+            params = faiss.SearchParameters(sel=faiss.IDSelectorBitmap(len(mask), faiss.swig_ptr(bitmap)))
+
         logger.info(f"Кодирование запроса: '{query_text}'")
-        query_embedding = model.encode([query_text])
+        with stage("encode"):
+            query_embedding = encode_queries([query_text])
 
         logger.info("Поиск ближайших соседей в индексе FAISS")
-        _, indices = index.search(query_embedding, k)
+        with stage("search"):
+            _, indices = index.search(query_embedding, k, params=params)
 
-        results = [texts[i] for i in indices[0] if i < len(texts)]
+        # -1 - соседей, удовлетворяющих фильтру, меньше k
+        results = [metadata.texts[i] for i in indices[0] if 0 <= i < len(metadata)]
         logger.info(f"Найдено {len(results)} ближайших соседей")
         return results
     except Exception as e:
@@ -92,6 +152,75 @@ def query_index(index: faiss.Index, texts: List[str], query_text: str, model: Se
         raise
 
 
+def _passage_vectors(index: "faiss.Index") -> np.ndarray:
+    """Возвращает векторы плоского индекса FAISS без копирования (или копию для других типов индекса)."""
+    import faiss
+
+    try:
+        return faiss.rev_swig_ptr(index.get_xb(), index.ntotal * index.d).reshape(index.ntotal, index.d)
+    except AttributeError:
+        return index.reconstruct_n(0, index.ntotal)
+
+
+@profiled
+def query_index_hierarchical(
+        index: "faiss.Index",
+        metadata: ChunkMetadata,
+        pages: PageIndex,
+        query_text: str,
+        k: int = 5,
+        filters: Optional[List[Filter]] = None,
+        n_pages: int = CANDIDATE_PAGES
+) -> List[str]:
+    """
+    Двухуровневый поиск: сначала страницы-кандидаты, затем фрагменты только этих страниц.
+
+    Стоимость второго этапа пропорциональна числу фрагментов страниц-кандидатов,
+    а не размеру всего индекса.
+
+    Args:
+        index: Плоский индекс FAISS фрагментов, упорядоченных по страницам
+        metadata: Метаданные фрагментов
+        pages: Индекс уровня страниц
+        query_text: Текст запроса
+        k: Число возвращаемых фрагментов
+        filters: Нормализованные условия фильтра (см. parse_filters)
+        n_pages: Число страниц-кандидатов
+
+    Returns:
+        List[str]: Тексты найденных фрагментов
+    """
+    try:
+        mask = metadata.mask(filters) if filters else None
+        page_mask = pages.allowed_pages(mask) if mask is not None else None
+
+        logger.info(f"Кодирование запроса: '{query_text}'")
+        with stage("encode"):
+            query_embedding = encode_queries([query_text])
+
+        logger.info(f"Поиск {n_pages} страниц-кандидатов в индексе страниц")
+        with stage("search_pages"):
+            candidates = pages.candidate_pages(query_embedding, n_pages, page_mask)
+            rows = pages.passage_rows(candidates)
+            if mask is not None:
+                rows = rows[mask[rows]]
+        if not len(rows):
+            return []
+
+        logger.info(f"Ранжирование {len(rows)} фрагментов {len(candidates)} страниц")
+        with stage("rank_passages"):
+            scores = _passage_vectors(index)[rows] @ query_embedding[0]
+            top = np.argpartition(-scores, min(k, len(rows)) - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+
+        results = [metadata.texts[i] for i in rows[top]]
+        logger.info(f"Найдено {len(results)} ближайших соседей")
+        return results
+    except Exception as e:
+        logger.error(f"Ошибка при двухуровневом поиске: {str(e)}")
+        raise
+
+
 def prepare_prompt(question: str, context: List[str], max_context_length: int = 5) -> str:
     """
     Формирует промпт с вопросом и контекстом из базы.
@@ -124,17 +253,17 @@ def prepare_prompt(question: str, context: List[str], max_context_length: int =
     )
 
 
-def query_ollama(prompt: str, model: str = "llama3.2", timeout: int = 600) -> str:
+def stream_ollama(prompt: str, model: str = "llama3.2", timeout: int = 600) -> Iterator[str]:
     """
-    Запрашивает Ollama для генерации ответа на основе промпта.
+    Запрашивает Ollama и возвращает ответ по мере генерации.
 
     Args:
         prompt: Промпт для отправки модели
         model: Название модели Ollama
         timeout: Таймаут запроса
 
-    Returns:
-        str: Сгенерированный ответ
+    Yields:
+        str: Очередной фрагмент сгенерированного ответа
     """
     url = "http://localhost:8905/api/generate"
     payload = {
@@ -157,18 +286,14 @@ def query_ollama(prompt: str, model: str = "llama3.2", timeout: int = 600) -> st
         )
 
         if response.status_code == 200:
-            full_response = ""
             for line in response.iter_lines():
                 if line:
                     try:
                         data = json.loads(line.decode('utf-8'))
                         if "response" in data:
-                            full_response += data["response"]
+                            yield data["response"]
                     except json.JSONDecodeError:
                         continue  # Игнорируем ошибки декодирования
-
-            logger.info(f"Получен ответ от Ollama: {full_response[:50]}...")
-            return full_response
         else:
             logger.error(f"Ошибка запроса к Ollama: {response.status_code}, {response.text}")
             raise Exception(f"Error querying Ollama: {response.status_code}, {response.text}")
@@ -181,49 +306,330 @@ def query_ollama(prompt: str, model: str = "llama3.2", timeout: int = 600) -> st
         raise
 
 
-def answer_question(question: str) -> str:
+def query_ollama(prompt: str, model: str = "llama3.2", timeout: int = 600) -> str:
     """
-    Обрабатывает вопрос пользователя от начала до конца.
+    Запрашивает Ollama для генерации ответа на основе промпта.
 
     Args:
-        question: Вопрос пользователя
+        prompt: Промпт для отправки модели
+        model: Название модели Ollama
+        timeout: Таймаут запроса
 
     Returns:
         str: Сгенерированный ответ
     """
+    full_response = "".join(stream_ollama(prompt, model=model, timeout=timeout))
+    logger.info(f"Получен ответ от Ollama: {full_response[:50]}...")
+    return full_response
+
+
+def normalize_question(question: str) -> str:
+    """Приводит вопрос к каноническому виду для поиска одинаковых запросов."""
+    return re.sub(r"\s+", " ", question).strip().casefold()
+
+
+def get_index_version() -> str:
+    """Возвращает идентификатор версии индекса, обслуживающей запросы."""
+    return _INDEX_STORE.get()[0]
+
+
+def get_index() -> Tuple["faiss.Index", ChunkMetadata, Optional[PageIndex]]:
+    """
+    Возвращает индекс FAISS, метаданные и индекс страниц текущей версии.
+
+    Новые опубликованные версии подхватываются в фоне без остановки сервиса.
+
+    Returns:
+        Tuple[faiss.Index, ChunkMetadata, Optional[PageIndex]]: Индекс, метаданные и индекс страниц
+            (None, если версия собрана без двухуровневого индекса)
+    """
+    _, index, metadata, pages = _INDEX_STORE.get()
+    return index, metadata, pages
+
+
+@contextmanager
+def _timed(timings: Dict[str, float], phase: str) -> Iterator[None]:
+    """Записывает длительность фазы в секундах в словарь timings."""
+    started_at = time.perf_counter()
     try:
-        logger.info(f"Обработка вопроса: {question}")
+        yield
+    finally:
+        timings[phase] = time.perf_counter() - started_at
+        logger.info(f"Фаза '{phase}' заняла {timings[phase]:.3f} с")
+
+
+def warm_up() -> Dict[str, float]:
+    """
+    Прогревает сервис: загружает модель и индекс и выполняет пробный поиск.
+
+    После успешного прогрева сервис считается готовым к приему запросов.
+
+    Returns:
+        Dict[str, float]: Длительность каждой фазы прогрева в секундах
+    """
+    timings: Dict[str, float] = {}
+    logger.info("Прогрев сервиса запросов")
+
+    with _timed(timings, "import_faiss"):
+        import faiss  # noqa: F401
+    with _timed(timings, "import_sentence_transformers"):
+        import sentence_transformers  # noqa: F401
+    with _timed(timings, "load_model"):
+        get_model()
+    with _timed(timings, "load_index"):
+        index, _, pages = get_index()
+    with _timed(timings, "dummy_encode"):
+        # Тот же путь кодирования, что и у запросов, включая кэш вопросов
+        query_embedding = encode_queries(["Прогрев"])
+    with _timed(timings, "dummy_search"):
+        index.search(query_embedding, 1)
+        if pages is not None:
+            pages.index.search(query_embedding, 1)
+
+    _READY.set()
+    logger.info(f"Сервис готов к работе, прогрев занял {sum(timings.values()):.3f} с")
+    return timings
+
+
+def is_ready() -> bool:
+    """Проверяет, завершен ли прогрев сервиса."""
+    return _READY.is_set()
+
+
+def profiler_from_header(value: Optional[str]) -> Optional[Profiler]:
+    """
+    Создает профилировщик запроса по значению заголовка X-Profile.
+
+    Любое непустое значение, кроме "0", включает запись времени по этапам;
+    перечисленные через запятую "flamegraph" и "memory" дополнительно
+    включают сэмплирование стеков и отслеживание пика памяти.
+
+    Args:
+        value: Значение заголовка X-Profile или None
+
+    Returns:
+        Optional[Profiler]: Профилировщик или None, если профилирование не запрошено или запрещено
+    """
+    options = {option.strip().lower() for option in (value or "").split(",")} - {""}
+    if not options or options == {"0"} or not PROFILING_ENABLED:
+        return None
+    # Запросы выполняются параллельно в одном процессе, поэтому учитывается процессорное время потока
+    return Profiler("query", flamegraph="flamegraph" in options, memory="memory" in options,
+                    cpu_clock=time.thread_time)
+
+
+def _retrieve(question: str, filters: List[Filter], hierarchical: Optional[bool]) -> List[str]:
+    """
+    Находит контекст для вопроса в текущей версии индекса.
 
-        # Пути к данным
-        data_folder = os.path.join(os.path.dirname(__file__), '..', '..', 'data')
-        path_faiss = os.path.join(data_folder, 'faiss_index.bin')
-        path_metadata = os.path.join(data_folder, 'metadata.pkl')
+    Args:
+        question: Вопрос пользователя
+        filters: Нормализованные условия фильтра по метаданным
+        hierarchical: Использовать ли двухуровневый поиск (None - если он есть в текущей версии)
+
+    Returns:
+        List[str]: Тексты найденных фрагментов
+    """
+    # Индекс и метаданные текущей опубликованной версии
+    with stage("get_index"):
+        index, metadata, pages = get_index()
+    if hierarchical and pages is None:
+        logger.warning("Текущая версия индекса собрана без индекса страниц, используется плоский поиск")
+
+    # Поиск в FAISS (эмбеддинги повторных вопросов берутся из кэша)
+    if pages is not None and hierarchical is not False:
+        return query_index_hierarchical(index=index, metadata=metadata, pages=pages,
+                                        query_text=question, filters=filters)
+    return query_index(index=index, metadata=metadata, query_text=question, filters=filters)
+
+
+def _generate_answer(
+        question: str,
+        filters: List[Filter],
+        hierarchical: Optional[bool],
+        priority: str,
+        deadline: Deadline,
+        profiler: Optional[Profiler] = None
+) -> Iterator[str]:
+    """
+    Выполняет поиск контекста и генерацию ответа на вопрос.
 
-        # Загрузка индекса и метаданных
-        index, texts = load_faiss_index_and_metadata(path_faiss, path_metadata)
+    Args:
+        question: Вопрос пользователя
+        filters: Нормализованные условия фильтра по метаданным
+        hierarchical: Использовать ли двухуровневый поиск (None - если он есть в текущей версии)
+        priority: Полоса приоритета запроса
+        deadline: Дедлайн генерации
+        profiler: Профилировщик запроса (отчет сохраняется по окончании генерации)
+
+    Yields:
+        str: Очередной фрагмент ответа
+    """
+    with profile_run(profiler), ExitStack() as slot:
+        with stage("admission_wait"):
+            slot.enter_context(_ADMISSION.slot(priority, deadline))
+        deadline.check("поиск контекста")
 
-        # Поиск в FAISS
-        model = get_model()
-        query_results = query_index(index=index, texts=texts, query_text=question, model=model)
+        # Ссылки на версию индекса не переживают поиск: иначе запрос, долго получающий
+        # ответ от Ollama, удерживал бы в памяти уже замененные версии
+        query_results = _retrieve(question, filters, hierarchical)
 
         if not query_results:
             logger.warning("Не найдено релевантного контекста для вопроса")
-            return "В базе данных нет информации по данному вопросу."
+            yield "В базе данных нет информации по данному вопросу."
+            return
 
         # Подготовка промпта и запрос к Ollama
-        prompt = prepare_prompt(question, query_results)
-        answer = query_ollama(prompt)
+        with stage("prepare_prompt"):
+            prompt = prepare_prompt(question, query_results)
+        deadline.check("генерация ответа")
+        with stage("generate"):
+            for chunk in stream_ollama(prompt, timeout=max(1, math.ceil(deadline.remaining()))):
+                deadline.check("генерация ответа")
+                yield chunk
+
+
+def _attach_answer(
+        question: str,
+        filters: Optional[Dict[str, Any]],
+        hierarchical: Optional[bool],
+        priority: str,
+        deadline: Deadline,
+        profiler: Optional[Profiler] = None
+):
+    """
+    Присоединяется к генерации ответа на такой же вопрос или запускает новую.
+
+    Генерация выполняется в полосе запустившего ее запроса, поэтому запросы
+    присоединяются только к генерациям своей полосы приоритета: иначе
+    интерактивный запрос ждал бы в пакетной очереди. Профилируемый запрос
+    всегда запускает собственную генерацию, чтобы отчет описывал именно его.
+    """
+    parsed_filters = parse_filters(filters)
+    key = (normalize_question(question), json.dumps(filters or {}, sort_keys=True), hierarchical, priority,
+           get_index_version(), profiler and profiler.run_id)
+    return _ANSWERS.attach(
+        key,
+        lambda generation_deadline: _generate_answer(question, parsed_filters, hierarchical, priority,
+                                                     generation_deadline, profiler),
+        deadline
+    )
+
+
+def answer_question(
+        question: str,
+        priority: str = "interactive",
+        timeout: Optional[float] = None,
+        filters: Optional[Dict[str, Any]] = None,
+        hierarchical: Optional[bool] = None,
+        profiler: Optional[Profiler] = None
+) -> str:
+    """
+    Обрабатывает вопрос пользователя от начала до конца.
+
+    Одинаковые вопросы к одной и той же версии индекса, пришедшие во время
+    генерации ответа, не запускают новую генерацию, а получают ее результат.
+
+    Args:
+        question: Вопрос пользователя
+        priority: Полоса приоритета запроса ("interactive" или "batch")
+        timeout: Время в секундах, за которое нужно получить ответ
+        filters: Фильтр по метаданным чанков, например {"ru_wiki_pageid": [123, 456]}
+        hierarchical: Использовать ли двухуровневый поиск (None - если он есть в текущей версии индекса)
+        profiler: Профилировщик запроса (см. profiler_from_header)
+
+    Returns:
+        str: Сгенерированный ответ
+
+    Raises:
+        AdmissionError: Если запрос не принят в очередь или не успел до дедлайна
+        FilterError: Если выражение фильтра некорректно
+    """
+    try:
+        logger.info(f"Обработка вопроса: {question}")
+
+        deadline = Deadline(timeout)
+        answer = _attach_answer(question, filters, hierarchical, priority, deadline, profiler).result(deadline)
 
         logger.info("Вопрос обработан успешно")
         return answer
 
+    except (AdmissionError, FilterError):
+        raise
     except Exception as e:
         logger.error(f"Ошибка при обработке вопроса: {str(e)}", exc_info=True)
         return "Произошла ошибка при обработке вашего запроса."
 
 
+def stream_answer(
+        question: str,
+        priority: str = "interactive",
+        timeout: Optional[float] = None,
+        filters: Optional[Dict[str, Any]] = None,
+        hierarchical: Optional[bool] = None,
+        profiler: Optional[Profiler] = None
+) -> Iterator[str]:
+    """
+    Обрабатывает вопрос пользователя, возвращая ответ по мере генерации.
+
+    Args:
+        question: Вопрос пользователя
+        priority: Полоса приоритета запроса ("interactive" или "batch")
+        timeout: Время в секундах, за которое нужно получить ответ
+        filters: Фильтр по метаданным чанков, например {"ru_wiki_pageid": [123, 456]}
+        hierarchical: Использовать ли двухуровневый поиск (None - если он есть в текущей версии индекса)
+        profiler: Профилировщик запроса (см. profiler_from_header)
+
+    Yields:
+        str: Очередной фрагмент ответа
+
+    Raises:
+        AdmissionError: Если запрос не принят в очередь или не успел до дедлайна
+        FilterError: Если выражение фильтра некорректно
+    """
+    try:
+        logger.info(f"Обработка вопроса (потоковый режим): {question}")
+        deadline = Deadline(timeout)
+        yield from _attach_answer(question, filters, hierarchical, priority, deadline, profiler).stream(deadline)
+        logger.info("Вопрос обработан успешно")
+    except (AdmissionError, FilterError):
+        raise
+    except Exception as e:
+        logger.error(f"Ошибка при обработке вопроса: {str(e)}", exc_info=True)
+        yield "Произошла ошибка при обработке вашего запроса."
+
+
+def get_coalescing_stats() -> dict:
+    """Возвращает статистику объединения одинаковых запросов."""
+    return _ANSWERS.stats()
+
+
+def request_admission(priority: str) -> ContextManager[None]:
+    """
+    Учитывает запрос в обработке до того, как он займет поток пула.
+
+    Raises:
+        QueueFullError: Если сервис перегружен или очередь полосы заполнена
+    """
+    return _ADMISSION.request(priority)
+
+
+def get_admission_stats() -> dict:
+    """Возвращает глубину очередей, время ожидания и счетчики отказов."""
+    return _ADMISSION.stats()
+
+
 def main():
     """Основная функция для обработки вопроса пользователя"""
+    # Настройка логгирования
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        handlers=[
+            logging.FileHandler(os.path.join(os.path.dirname(__file__), 'app.log'), encoding='utf-8'),
+            logging.StreamHandler()
+        ]
+    )
     question = 'Город Люксембург впервые упоминается в каком году?'
     answer = answer_question(question)
     print(f"Вопрос: {question}")
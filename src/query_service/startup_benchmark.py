@@ -0,0 +1,57 @@
+"""
+Замер времени холодного старта службы запросов по фазам.
+
+Запускается в новом процессе, чтобы импорт модулей не был закеширован:
+
+    python startup_benchmark.py
+    python startup_benchmark.py --import-budget 0.3
+    python startup_benchmark.py --bake ../../models/query_model
+
+С ключом --bake сохраняет снимок модели в каталог; затем сервис можно
+запускать с EMBEDDING_MODEL_PATH=<каталог> без обращений к Hugging Face Hub.
+"""
+import argparse
+import json
+import logging
+import sys
+import time
+
+# Бюджет времени импорта модуля query по умолчанию, секунды
+IMPORT_TIME_BUDGET = 0.5
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Замер холодного старта службы запросов")
+    parser.add_argument("--import-budget", type=float, default=IMPORT_TIME_BUDGET,
+                        help="Допустимое время импорта модуля query, секунды")
+    parser.add_argument("--bake", metavar="DIR", help="Сохранить снимок модели в каталог и выйти")
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+
+    started_at = time.perf_counter()
+    import query
+    import_time = time.perf_counter() - started_at
+
+    if args.bake:
+        from src.shared.embeddings import save_model_snapshot
+
+        save_model_snapshot(args.bake)
+        return
+
+    timings = {"import_query": import_time}
+    timings.update(query.warm_up())
+    timings["total"] = sum(timings.values())
+
+    print(json.dumps({phase: round(seconds, 4) for phase, seconds in timings.items()}, indent=2))
+
+    if import_time > args.import_budget:
+        print(f"Импорт модуля query занял {import_time:.3f} с, бюджет {args.import_budget:.3f} с", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+import time
+import uuid
+from datetime import datetime
+from typing import Any, Callable, Dict, Optional
+
+from src.shared.config import BUNDLES_FOLDER
+
+logger = logging.getLogger(__name__)
+
+# Файлы версии индекса и указатель на текущую версию
+INDEX_FILE = 'faiss_index.bin'
+METADATA_FILE = 'metadata.pkl'
+MANIFEST_FILE = 'manifest.json'
+CURRENT_POINTER = 'CURRENT'
+
+# Префикс временных каталогов, в которых собираются версии
+STAGING_PREFIX = '.staging-'
+
+
+def file_sha256(path: str) -> str:
+    """Вычисляет SHA-256 файла."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _fsync_dir(path: str) -> None:
+    """Сбрасывает на диск запись каталога (переименования внутри него)."""
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def publish_bundle(
+        write_files: Callable[[str], None],
+        manifest: Dict[str, Any],
+        bundles_folder: str = BUNDLES_FOLDER,
+        keep: int = 3
+) -> str:
+    """
+    Публикует неизменяемую версию индекса.
+
+    Файлы версии записываются во временный каталог, к ним добавляется
+    манифест с контрольными суммами, после чего каталог переименовывается
+    в каталог версии, а указатель CURRENT атомарно заменяется на новую версию.
+    Читатель всегда видит либо старую, либо новую версию целиком.
+
+    Args:
+        write_files: Функция, записывающая файлы версии в переданный каталог
+        manifest: Описание версии (модель, параметры разбиения, статистика сборки)
+        bundles_folder: Каталог с версиями индекса
+        keep: Сколько последних версий хранить (текущая не удаляется никогда)
+
+    Returns:
+        str: Идентификатор опубликованной версии
+    """
+    os.makedirs(bundles_folder, exist_ok=True)
+    # Время с микросекундами: версии, опубликованные в одну секунду, упорядочены по времени создания
+    version = f"{datetime.now().strftime('%Y%m%dT%H%M%S%f')}-{uuid.uuid4().hex[:8]}"
+    staging = os.path.join(bundles_folder, STAGING_PREFIX + version)
+    os.makedirs(staging)
+
+    try:
+        logger.info(f"Сборка версии индекса {version}")
+        write_files(staging)
+
+        files = {}
+        for name in sorted(os.listdir(staging)):
+            path = os.path.join(staging, name)
+            files[name] = {"sha256": file_sha256(path), "size": os.path.getsize(path)}
+            with open(path, 'rb') as f:
+                os.fsync(f.fileno())
+
+        manifest = {**manifest, "version": version, "created_at": time.strftime('%Y-%m-%dT%H:%M:%S%z'), "files": files}
+        with open(os.path.join(staging, MANIFEST_FILE), 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+
+        os.rename(staging, os.path.join(bundles_folder, version))
+    except Exception:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+
+    # Атомарная замена указателя на текущую версию
+    pointer_tmp = os.path.join(bundles_folder, f"{CURRENT_POINTER}.{version}.tmp")
+    with open(pointer_tmp, 'w', encoding='utf-8') as f:
+        f.write(version)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(pointer_tmp, os.path.join(bundles_folder, CURRENT_POINTER))
+    _fsync_dir(bundles_folder)
+    logger.info(f"Опубликована версия индекса {version}")
+
+    prune_bundles(bundles_folder, keep=keep)
+    return version
+
+
+def list_bundles(bundles_folder: str = BUNDLES_FOLDER) -> list:
+    """Возвращает опубликованные версии в порядке создания (без собираемых во временных каталогах)."""
+    if not os.path.isdir(bundles_folder):
+        return []
+    return sorted(
+        name for name in os.listdir(bundles_folder)
+        if not name.startswith(STAGING_PREFIX) and os.path.isfile(os.path.join(bundles_folder, name, MANIFEST_FILE))
+    )
+
+
+def prune_bundles(bundles_folder: str = BUNDLES_FOLDER, keep: int = 3) -> None:
+    """
+    Удаляет старые версии, оставляя keep последних и текущую.
+
+    Args:
+        bundles_folder: Каталог с версиями индекса
+        keep: Сколько последних версий хранить
+    """
+    current = current_version(bundles_folder)
+    for version in list_bundles(bundles_folder)[:-keep or None]:
+        if version != current:
+            logger.info(f"Удаление устаревшей версии индекса {version}")
+            shutil.rmtree(os.path.join(bundles_folder, version), ignore_errors=True)
+
+
+def current_version(bundles_folder: str = BUNDLES_FOLDER) -> Optional[str]:
+    """Возвращает текущую опубликованную версию или None, если версий нет."""
+    try:
+        with open(os.path.join(bundles_folder, CURRENT_POINTER), 'r', encoding='utf-8') as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def bundle_path(version: str, bundles_folder: str = BUNDLES_FOLDER) -> str:
+    """Возвращает каталог версии индекса."""
+    return os.path.join(bundles_folder, version)
+
+
+def load_manifest(path: str) -> Dict[str, Any]:
+    """Читает манифест версии из ее каталога."""
+    with open(os.path.join(path, MANIFEST_FILE), 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def verify_bundle(path: str, manifest: Dict[str, Any]) -> None:
+    """
+    Проверяет размеры и контрольные суммы файлов версии.
+
+    Args:
+        path: Каталог версии
+        manifest: Манифест версии
+
+    Raises:
+        ValueError: Если файл версии поврежден или отсутствует
+    """
+    for name, expected in manifest["files"].items():
+        file_path = os.path.join(path, name)
+        if not os.path.exists(file_path) or os.path.getsize(file_path) != expected["size"]:
+            raise ValueError(f"Файл {name} версии {manifest['version']} отсутствует или имеет неверный размер")
+        if file_sha256(file_path) != expected["sha256"]:
+            raise ValueError(f"Контрольная сумма файла {name} версии {manifest['version']} не совпадает")
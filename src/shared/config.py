@@ -0,0 +1,23 @@
+import os
+
+# Папка с данными проекта (индексы, метаданные, кэш эмбеддингов)
+DATA_FOLDER = os.path.join(os.path.dirname(__file__), '..', '..', 'data')
+
+# Модель эмбеддингов, общая для служб индексации и запросов
+MODEL_NAME = os.getenv("EMBEDDING_MODEL_NAME", 'paraphrase-multilingual-MiniLM-L12-v2')
+MODEL_REVISION = os.getenv("EMBEDDING_MODEL_REVISION") or None
+
+# Каталог с заранее сохраненным снимком модели (загрузка без обращений к hub)
+MODEL_PATH = os.getenv("EMBEDDING_MODEL_PATH") or None
+
+# Каталог дискового кэша эмбеддингов
+EMBEDDING_CACHE_DIR = os.getenv("EMBEDDING_CACHE_DIR", os.path.join(DATA_FOLDER, 'embedding_cache'))
+
+# Число эмбеддингов вопросов в кэше службы запросов (в памяти, без общего дискового кэша)
+QUERY_EMBEDDING_CACHE_SIZE = int(os.getenv("QUERY_EMBEDDING_CACHE_SIZE", "10000"))
+
+# Каталог с опубликованными версиями индекса
+BUNDLES_FOLDER = os.getenv("INDEX_BUNDLES_DIR", os.path.join(DATA_FOLDER, 'index_bundles'))
+
+# Каталог отчетов профилирования прогонов индексации и запросов
+PROFILES_FOLDER = os.getenv("PROFILES_DIR", os.path.join(DATA_FOLDER, 'profiles'))
@@ -0,0 +1,332 @@
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from filelock import FileLock
+
+from src.shared.config import (
+    MODEL_NAME, MODEL_REVISION, MODEL_PATH, EMBEDDING_CACHE_DIR, QUERY_EMBEDDING_CACHE_SIZE
+)
+from src.shared.utils import TEXT_HASH_SIZE, text_hash, safe_name
+
+# sentence_transformers (вместе с torch) импортируется лениво при загрузке модели
+if TYPE_CHECKING:
+    from sentence_transformers import SentenceTransformer
+
+logger = logging.getLogger(__name__)
+
+
+class ModelRegistry:
+    """Реестр загруженных моделей SentenceTransformer по имени и ревизии."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._models: Dict[Tuple[str, Optional[str]], "SentenceTransformer"] = {}
+
+    def get(self, name: str = MODEL_NAME, revision: Optional[str] = MODEL_REVISION) -> "SentenceTransformer":
+        """
+        Получает или загружает модель.
+
+        Если задан EMBEDDING_MODEL_PATH, модель по умолчанию загружается из
+        сохраненного снимка в этом каталоге без обращений к Hugging Face Hub.
+
+        Args:
+            name: Название модели
+            revision: Ревизия модели (None - последняя)
+
+        Returns:
+            SentenceTransformer: Загруженная модель
+        """
+        key = (name, revision)
+        with self._lock:
+            if key not in self._models:
+                from sentence_transformers import SentenceTransformer
+
+                if MODEL_PATH is not None and key == (MODEL_NAME, MODEL_REVISION):
+                    logger.info(f"Загрузка модели SentenceTransformer из снимка {MODEL_PATH}...")
+                    self._models[key] = SentenceTransformer(MODEL_PATH, local_files_only=True)
+                else:
+                    logger.info(f"Загрузка модели SentenceTransformer {name} (ревизия: {revision or 'последняя'})...")
+                    self._models[key] = SentenceTransformer(name, revision=revision)
+            return self._models[key]
+
+
+class EmbeddingCache:
+    """
+    Дисковый кэш эмбеддингов с адресацией по содержимому текста.
+
+    Ключи (хэши текстов) и векторы хранятся в двух файлах, дополняемых в
+    одном и том же порядке: строка i файла векторов - эмбеддинг текста с
+    i-м ключом. Файл векторов отображается в память, поэтому чтение не
+    требует загрузки всего кэша. Запись защищена файловой блокировкой и
+    безопасна для нескольких процессов индексации.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._keys_path = os.path.join(directory, 'keys.bin')
+        self._vectors_path = os.path.join(directory, 'vectors.f32')
+        self._meta_path = os.path.join(directory, 'meta.json')
+        self._file_lock = FileLock(os.path.join(directory, 'cache.lock'))
+        self._lock = threading.Lock()
+
+        self._dim: Optional[int] = None
+        self._rows: Dict[bytes, int] = {}
+        self._vectors: Optional[np.memmap] = None
+        # Число прочитанных строк кэша
+        self._size = 0
+
+    def _read_dim(self) -> Optional[int]:
+        if self._dim is None and os.path.exists(self._meta_path):
+            with open(self._meta_path, 'r', encoding='utf-8') as f:
+                self._dim = json.load(f)["dim"]
+        return self._dim
+
+    def _complete_rows(self) -> int:
+        """Число строк, для которых записаны и ключ, и вектор."""
+        dim = self._read_dim()
+        if dim is None or not os.path.exists(self._keys_path) or not os.path.exists(self._vectors_path):
+            return 0
+        keys = os.path.getsize(self._keys_path) // TEXT_HASH_SIZE
+        vectors = os.path.getsize(self._vectors_path) // (dim * 4)
+        return min(keys, vectors)
+
+    def _refresh(self) -> None:
+        """Подхватывает записи, добавленные с момента последнего чтения (в т.ч. другими процессами)."""
+        n = self._complete_rows()
+        if n <= self._size:
+            return
+
+        with open(self._keys_path, 'rb') as f:
+            f.seek(self._size * TEXT_HASH_SIZE)
+            data = f.read((n - self._size) * TEXT_HASH_SIZE)
+        for i in range(n - self._size):
+            self._rows.setdefault(data[i * TEXT_HASH_SIZE:(i + 1) * TEXT_HASH_SIZE], self._size + i)
+
+        self._size = n
+        self._vectors = np.memmap(self._vectors_path, dtype=np.float32, mode='r', shape=(n, self._dim))
+
+    def lookup(self, hashes: Sequence[bytes]) -> np.ndarray:
+        """
+        Находит строки кэша для хэшей текстов.
+
+        Args:
+            hashes: Хэши текстов
+
+        Returns:
+            np.ndarray: Номера строк кэша, -1 для отсутствующих текстов
+        """
+        with self._lock:
+            self._refresh()
+            return np.fromiter((self._rows.get(h, -1) for h in hashes), dtype=np.int64, count=len(hashes))
+
+    def read(self, rows: np.ndarray) -> np.ndarray:
+        """Возвращает копию векторов из указанных строк кэша."""
+        with self._lock:
+            return np.array(self._vectors[rows], dtype=np.float32)
+
+    def put(self, hashes: Sequence[bytes], vectors: np.ndarray) -> None:
+        """
+        Добавляет эмбеддинги в кэш.
+
+        Args:
+            hashes: Хэши текстов
+            vectors: Эмбеддинги текстов, по одной строке на хэш
+        """
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        with self._lock, self._file_lock:
+            if self._read_dim() is None:
+                with open(self._meta_path, 'w', encoding='utf-8') as f:
+                    json.dump({"dim": int(vectors.shape[1])}, f)
+                self._dim = int(vectors.shape[1])
+            elif self._dim != vectors.shape[1]:
+                raise ValueError(f"Размерность эмбеддингов {vectors.shape[1]} не совпадает с размерностью кэша {self._dim}")
+
+            self._refresh()
+            new = [i for i, h in enumerate(hashes) if h not in self._rows]
+            if not new:
+                return
+
+            # Отбрасываем хвосты, оставшиеся от прерванной записи, чтобы ключи и векторы не разъехались
+            n = self._size
+            for path, row_size in ((self._vectors_path, self._dim * 4), (self._keys_path, TEXT_HASH_SIZE)):
+                with open(path, 'ab') as f:
+                    f.truncate(n * row_size)
+
+            # Векторы пишутся раньше ключей: ключ никогда не ссылается на незаписанный вектор
+            with open(self._vectors_path, 'ab') as f:
+                f.write(vectors[new].tobytes())
+            with open(self._keys_path, 'ab') as f:
+                f.write(b"".join(hashes[i] for i in new))
+
+            self._refresh()
+
+
+class QueryEmbeddingCache:
+    """
+    Ограниченный кэш эмбеддингов в памяти с вытеснением давно не использованных текстов.
+
+    Используется службой запросов для вопросов пользователей: в отличие от
+    общего дискового кэша, он не читает ключи всего корпуса, не берет
+    межпроцессную блокировку и не растет без ограничений.
+    """
+
+    def __init__(self, max_size: int = QUERY_EMBEDDING_CACHE_SIZE):
+        self._max_size = max_size
+        self._lock = threading.Lock()
+        self._vectors: "OrderedDict[Tuple[str, Optional[str], bytes], np.ndarray]" = OrderedDict()
+
+    def get(self, key: Tuple[str, Optional[str], bytes]) -> Optional[np.ndarray]:
+        """Возвращает эмбеддинг или None, если его нет в кэше."""
+        with self._lock:
+            vector = self._vectors.get(key)
+            if vector is not None:
+                self._vectors.move_to_end(key)
+            return vector
+
+    def put(self, key: Tuple[str, Optional[str], bytes], vector: np.ndarray) -> None:
+        """Добавляет эмбеддинг, вытесняя самые давно использованные при переполнении."""
+        if self._max_size <= 0:
+            return
+        with self._lock:
+            self._vectors[key] = vector
+            self._vectors.move_to_end(key)
+            while len(self._vectors) > self._max_size:
+                self._vectors.popitem(last=False)
+
+
+_REGISTRY = ModelRegistry()
+_CACHES: Dict[Tuple[str, Optional[str]], EmbeddingCache] = {}
+_CACHES_LOCK = threading.Lock()
+_QUERY_CACHE = QueryEmbeddingCache()
+
+
+def get_model(name: str = MODEL_NAME, revision: Optional[str] = MODEL_REVISION) -> "SentenceTransformer":
+    """Получает или создает экземпляр модели из общего реестра."""
+    return _REGISTRY.get(name, revision)
+
+
+def get_cache(name: str = MODEL_NAME, revision: Optional[str] = MODEL_REVISION) -> EmbeddingCache:
+    """Возвращает кэш эмбеддингов для модели с указанными именем и ревизией."""
+    with _CACHES_LOCK:
+        key = (name, revision)
+        if key not in _CACHES:
+            directory = os.path.join(EMBEDDING_CACHE_DIR, safe_name(f"{name}@{revision or 'default'}"))
+            _CACHES[key] = EmbeddingCache(directory)
+        return _CACHES[key]
+
+
+def save_model_snapshot(path: str, name: str = MODEL_NAME, revision: Optional[str] = MODEL_REVISION) -> None:
+    """
+    Сохраняет снимок модели в каталог для последующего запуска без обращений к hub.
+
+    Args:
+        path: Каталог для сохранения модели
+        name: Название модели
+        revision: Ревизия модели
+    """
+    from sentence_transformers import SentenceTransformer
+
+    logger.info(f"Сохранение снимка модели {name} в {path}")
+    SentenceTransformer(name, revision=revision).save(path)
+
+
+def encode(
+        texts: List[str],
+        name: str = MODEL_NAME,
+        revision: Optional[str] = MODEL_REVISION,
+        batch_size: int = 32,
+        show_progress_bar: bool = False,
+        use_cache: bool = True
+) -> np.ndarray:
+    """
+    Кодирует тексты, пропуская уже закодированные ранее.
+
+    Эмбеддинги берутся из дискового кэша по хэшу текста; кодируются только
+    новые уникальные тексты, и их эмбеддинги добавляются в кэш.
+
+    Args:
+        texts: Список текстов
+        name: Название модели
+        revision: Ревизия модели
+        batch_size: Размер батча для кодирования
+        show_progress_bar: Показывать ли прогресс кодирования
+        use_cache: Использовать ли дисковый кэш
+
+    Returns:
+        np.ndarray: Массив эмбеддингов float32, по строке на текст
+    """
+    if not use_cache:
+        return get_model(name, revision).encode(
+            texts, batch_size=batch_size, show_progress_bar=show_progress_bar, convert_to_numpy=True
+        ).astype(np.float32)
+
+    if not texts:
+        dimension = get_model(name, revision).get_sentence_embedding_dimension()
+        return np.empty((0, dimension), dtype=np.float32)
+
+    cache = get_cache(name, revision)
+    hashes = [text_hash(text) for text in texts]
+    rows = cache.lookup(hashes)
+    hits, misses = np.flatnonzero(rows >= 0), np.flatnonzero(rows < 0)
+
+    # Уникальные тексты, которых нет в кэше
+    missing: Dict[bytes, str] = {}
+    for i in misses:
+        missing.setdefault(hashes[i], texts[i])
+    logger.info(f"Эмбеддинги из кэша: {len(hits)} из {len(texts)}, к кодированию {len(missing)} уникальных текстов")
+
+    if not missing:
+        return cache.read(rows)
+
+    new_vectors = get_model(name, revision).encode(
+        list(missing.values()), batch_size=batch_size, show_progress_bar=show_progress_bar, convert_to_numpy=True
+    ).astype(np.float32)
+    try:
+        cache.put(list(missing), new_vectors)
+    except OSError as e:
+        logger.warning(f"Не удалось сохранить эмбеддинги в кэш: {str(e)}")
+
+    new_rows = {h: i for i, h in enumerate(missing)}
+    embeddings = np.empty((len(texts), new_vectors.shape[1]), dtype=np.float32)
+    embeddings[misses] = new_vectors[[new_rows[hashes[i]] for i in misses]]
+    if len(hits):
+        embeddings[hits] = cache.read(rows[hits])
+    return embeddings
+
+
+def encode_queries(
+        texts: List[str],
+        name: str = MODEL_NAME,
+        revision: Optional[str] = MODEL_REVISION
+) -> np.ndarray:
+    """
+    Кодирует вопросы пользователей через ограниченный кэш в памяти.
+
+    Общий дисковый кэш корпуса не используется: служба запросов не читает
+    его ключи и не дописывает в него вопросы.
+
+    Args:
+        texts: Список вопросов
+        name: Название модели
+        revision: Ревизия модели
+
+    Returns:
+        np.ndarray: Массив эмбеддингов float32, по строке на текст
+    """
+    keys = [(name, revision, text_hash(text)) for text in texts]
+    vectors = [_QUERY_CACHE.get(key) for key in keys]
+    misses = [i for i, vector in enumerate(vectors) if vector is None]
+    if misses:
+        new_vectors = encode([texts[i] for i in misses], name, revision, use_cache=False)
+        for i, vector in zip(misses, new_vectors):
+            vectors[i] = vector
+            _QUERY_CACHE.put(keys[i], vector)
+    if not vectors:
+        return encode(texts, name, revision, use_cache=False)
+    return np.stack(vectors)
@@ -0,0 +1,136 @@
+import logging
+import os
+import pickle
+from typing import TYPE_CHECKING, Any, List, Optional
+
+import numpy as np
+
+# faiss импортируется лениво, чтобы импорт модуля оставался быстрым
+if TYPE_CHECKING:
+    import faiss
+
+logger = logging.getLogger(__name__)
+
+# Файлы индекса уровня страниц в каталоге версии индекса
+PAGE_INDEX_FILE = 'page_index.bin'
+PAGES_FILE = 'pages.pkl'
+
+
+class PageIndex:
+    """
+    Индекс уровня страниц для двухуровневого поиска.
+
+    Каждой странице соответствует один вектор (по заголовку или вводным
+    предложениям) в небольшом индексе FAISS. Чанки индекса фрагментов
+    упорядочены по страницам: фрагменты страницы i занимают строки
+    offsets[i]:offsets[i + 1]. Поиск сначала выбирает страницы-кандидаты,
+    затем ранжирует только фрагменты этих страниц.
+    """
+
+    def __init__(self, index: "faiss.Index", page_ids: np.ndarray, offsets: np.ndarray, leads: List[str]):
+        self.index = index
+        self.page_ids = np.asarray(page_ids, dtype=np.int64)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.leads = list(leads)
+
+    def __len__(self) -> int:
+        return len(self.page_ids)
+
+    @staticmethod
+    def page_offsets(chunk_page_ids: np.ndarray) -> np.ndarray:
+        """
+        Вычисляет границы страниц в упорядоченном по страницам массиве чанков.
+
+        Args:
+            chunk_page_ids: ru_wiki_pageid каждого чанка, чанки одной страницы идут подряд
+
+        Returns:
+            np.ndarray: Смещения начала каждой страницы и общее число чанков в конце
+        """
+        chunk_page_ids = np.asarray(chunk_page_ids)
+        starts = np.flatnonzero(np.concatenate(([True], chunk_page_ids[1:] != chunk_page_ids[:-1])))
+        if len(np.unique(chunk_page_ids)) != len(starts):
+            raise ValueError("Чанки одной страницы должны идти подряд")
+        return np.concatenate((starts, [len(chunk_page_ids)])).astype(np.int64)
+
+    @classmethod
+    def build(cls, chunk_page_ids: np.ndarray, leads: List[str], embeddings: np.ndarray) -> "PageIndex":
+        """
+        Строит индекс уровня страниц.
+
+        Args:
+            chunk_page_ids: ru_wiki_pageid каждого чанка, чанки одной страницы идут подряд
+            leads: Текст каждой страницы для индекса страниц (заголовок или вводные предложения)
+            embeddings: Эмбеддинги текстов leads
+
+        Returns:
+            PageIndex: Индекс уровня страниц
+        """
+        import faiss
+
+        offsets = cls.page_offsets(chunk_page_ids)
+        if len(leads) != len(offsets) - 1 or len(embeddings) != len(leads):
+            raise ValueError("Количество текстов страниц не соответствует количеству страниц")
+
+        embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+        faiss.normalize_L2(embeddings)
+        index = faiss.IndexFlatIP(embeddings.shape[1])
+        index.add(embeddings)
+        logger.info(f"Создан индекс страниц с {index.ntotal} векторами")
+        return cls(index, np.asarray(chunk_page_ids)[offsets[:-1]], offsets, leads)
+
+    def save(self, folder: str) -> None:
+        """Сохраняет индекс страниц в каталог версии индекса."""
+        import faiss
+
+        faiss.write_index(self.index, os.path.join(folder, PAGE_INDEX_FILE))
+        with open(os.path.join(folder, PAGES_FILE), 'wb') as f:
+            pickle.dump({"ru_wiki_pageid": self.page_ids, "offsets": self.offsets, "lead": self.leads}, f)
+
+    @classmethod
+    def load(cls, folder: str) -> Optional["PageIndex"]:
+        """Загружает индекс страниц из каталога версии или возвращает None, если его там нет."""
+        import faiss
+
+        if not os.path.exists(os.path.join(folder, PAGE_INDEX_FILE)):
+            return None
+        index = faiss.read_index(os.path.join(folder, PAGE_INDEX_FILE))
+        with open(os.path.join(folder, PAGES_FILE), 'rb') as f:
+            columns = pickle.load(f)
+        if len(columns["ru_wiki_pageid"]) != index.ntotal:
+            raise ValueError("Количество страниц не соответствует количеству векторов в индексе страниц")
+        return cls(index, columns["ru_wiki_pageid"], columns["offsets"], columns["lead"])
+
+    def allowed_pages(self, chunk_mask: np.ndarray) -> np.ndarray:
+        """Маска страниц, у которых есть хотя бы один чанк из chunk_mask."""
+        return np.logical_or.reduceat(chunk_mask, self.offsets[:-1]) if len(self) else np.zeros(0, dtype=bool)
+
+    def candidate_pages(self, query_embedding: np.ndarray, n_pages: int,
+                        page_mask: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Выбирает страницы, наиболее близкие к запросу.
+
+        Args:
+            query_embedding: Эмбеддинг запроса формы (1, d)
+            n_pages: Число страниц-кандидатов
+            page_mask: Маска допустимых страниц (фильтр по метаданным)
+
+        Returns:
+            np.ndarray: Номера страниц-кандидатов
+        """
+        import faiss
+
+        params: Any = None
+        if page_mask is not None:
+            if not page_mask.any():
+                return np.empty(0, dtype=np.int64)
+            bitmap = np.packbits(page_mask, bitorder='little')
+            params = faiss.SearchParameters(sel=faiss.IDSelectorBitmap(len(page_mask), faiss.swig_ptr(bitmap)))
+        _, pages = self.index.search(query_embedding, n_pages, params=params)
+        return pages[0][pages[0] >= 0]
+
+    def passage_rows(self, pages: np.ndarray) -> np.ndarray:
+        """Возвращает строки индекса фрагментов, принадлежащие страницам pages."""
+        starts, ends = self.offsets[pages], self.offsets[pages + 1]
+        counts = ends - starts
+        return np.repeat(starts - np.concatenate(([0], np.cumsum(counts)[:-1])), counts) + np.arange(counts.sum())
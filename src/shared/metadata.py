@@ -0,0 +1,162 @@
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple, Union
+
+import numpy as np
+
+# pandas нужен только службе индексации
+if TYPE_CHECKING:
+    import pandas as pd
+
+# Поля метаданных, по которым можно фильтровать, и операции фильтрации
+FILTER_FIELDS = ("ru_wiki_pageid", "source_uid")
+FILTER_OPERATIONS = ("eq", "ne", "in", "not_in")
+
+# Нормализованный фильтр: (поле, операция, значения)
+Filter = Tuple[str, str, np.ndarray]
+
+
+class FilterError(ValueError):
+    """Некорректное выражение фильтра."""
+
+
+_INT64 = np.iinfo(np.int64)
+
+
+def _filter_value(field: str, value: Any) -> int:
+    """Проверяет, что значение фильтра - целое число, представимое в int64."""
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    if isinstance(value, bool) or not isinstance(value, (int, np.integer)):
+        raise FilterError(f"Значения фильтра поля '{field}' должны быть целыми числами, получено {value!r}")
+    if not _INT64.min <= value <= _INT64.max:
+        raise FilterError(f"Значение фильтра поля '{field}' вне допустимого диапазона: {value}")
+    return int(value)
+
+
+def parse_filters(filters: Optional[Dict[str, Any]]) -> List[Filter]:
+    """
+    Разбирает выражение фильтра по метаданным.
+
+    Выражение - словарь {поле: условие}, условия объединяются по И.
+    Условие - значение (равенство), список значений (вхождение в список)
+    или словарь {операция: значение(я)} с операциями eq, ne, in, not_in.
+    Для source_uid условие проверяется по всем исходным фрагментам чанка.
+
+    Пример: {"ru_wiki_pageid": {"in": [123, 456]}, "source_uid": {"ne": 7}}
+
+    Args:
+        filters: Выражение фильтра или None
+
+    Returns:
+        List[Filter]: Список нормализованных условий
+
+    Raises:
+        FilterError: Если выражение некорректно
+    """
+    parsed: List[Filter] = []
+    for field, condition in (filters or {}).items():
+        if field not in FILTER_FIELDS:
+            raise FilterError(f"Неизвестное поле фильтра '{field}', допустимые поля: {', '.join(FILTER_FIELDS)}")
+
+        if isinstance(condition, dict):
+            items = list(condition.items())
+        elif isinstance(condition, (list, tuple)):
+            items = [("in", condition)]
+        else:
+            items = [("eq", condition)]
+
+        for operation, value in items:
+            if operation not in FILTER_OPERATIONS:
+                raise FilterError(f"Неизвестная операция фильтра '{operation}', "
+                                  f"допустимые операции: {', '.join(FILTER_OPERATIONS)}")
+            values = value if operation in ("in", "not_in") else [value]
+            if not isinstance(values, (list, tuple)):
+                raise FilterError(f"Операция '{operation}' поля '{field}' ожидает список значений")
+            checked = [_filter_value(field, v) for v in values]
+            parsed.append((field, operation, np.asarray(checked, dtype=np.int64)))
+    return parsed
+
+
+class ChunkMetadata:
+    """
+    Метаданные чанков индекса, хранящиеся по колонкам.
+
+    Строка i соответствует вектору i индекса FAISS. У чанка хранятся uid тех
+    исходных фрагментов, текст которых попал в этот чанк (а не всех фрагментов
+    страницы). uid хранятся плоским массивом со смещениями: uid чанка i - это
+    source_uids[source_uid_offsets[i]:source_uid_offsets[i + 1]].
+    """
+
+    def __init__(
+            self,
+            texts: List[str],
+            page_ids: Optional[np.ndarray] = None,
+            source_uids: Optional[np.ndarray] = None,
+            source_uid_offsets: Optional[np.ndarray] = None
+    ):
+        self.texts = list(texts)
+        n = len(self.texts)
+        # -1 - страница неизвестна (метаданные старого формата)
+        self.page_ids = np.full(n, -1, dtype=np.int64) if page_ids is None else np.asarray(page_ids, dtype=np.int64)
+        self.source_uids = np.empty(0, dtype=np.int64) if source_uids is None else np.asarray(source_uids, dtype=np.int64)
+        self.source_uid_offsets = (np.zeros(n + 1, dtype=np.int64) if source_uid_offsets is None
+                                   else np.asarray(source_uid_offsets, dtype=np.int64))
+
+    def __len__(self) -> int:
+        return len(self.texts)
+
+    @classmethod
+    def from_dataframe(cls, df: "pd.DataFrame", column: str = 'text') -> "ChunkMetadata":
+        """
+        Создает метаданные из DataFrame после обработки.
+
+        Args:
+            df: DataFrame с колонками text, ru_wiki_pageid и source_uids (список uid)
+            column: Название колонки с текстом
+
+        Returns:
+            ChunkMetadata: Метаданные чанков
+        """
+        uids = df["source_uids"].tolist() if "source_uids" in df.columns else [[] for _ in range(len(df))]
+        lengths = np.fromiter((len(u) for u in uids), dtype=np.int64, count=len(uids))
+        offsets = np.concatenate(([0], np.cumsum(lengths))).astype(np.int64)
+        flat = np.fromiter((uid for u in uids for uid in u), dtype=np.int64, count=int(offsets[-1]))
+        page_ids = df["ru_wiki_pageid"].to_numpy(dtype=np.int64) if "ru_wiki_pageid" in df.columns else None
+        return cls(df[column].tolist(), page_ids, flat, offsets)
+
+    @classmethod
+    def from_columns(cls, columns: Union[Dict[str, Any], List[str]]) -> "ChunkMetadata":
+        """Восстанавливает метаданные из сохраненных колонок (или из списка текстов старого формата)."""
+        if isinstance(columns, list):
+            return cls(columns)
+        return cls(columns["text"], columns["ru_wiki_pageid"], columns["source_uids"], columns["source_uid_offsets"])
+
+    def to_columns(self) -> Dict[str, Any]:
+        """Возвращает колонки метаданных для сохранения."""
+        return {
+            "text": self.texts,
+            "ru_wiki_pageid": self.page_ids,
+            "source_uids": self.source_uids,
+            "source_uid_offsets": self.source_uid_offsets,
+        }
+
+    def mask(self, filters: List[Filter]) -> np.ndarray:
+        """
+        Вычисляет маску чанков, удовлетворяющих всем условиям фильтра.
+
+        Args:
+            filters: Нормализованные условия (см. parse_filters)
+
+        Returns:
+            np.ndarray: Булева маска длины len(self)
+        """
+        mask = np.ones(len(self), dtype=bool)
+        for field, operation, values in filters:
+            if field == "ru_wiki_pageid":
+                matches = np.isin(self.page_ids, values)
+            else:
+                # Чанк подходит, если хотя бы один из его исходных фрагментов входит в список
+                hits = np.isin(self.source_uids, values).astype(np.int64)
+                cumulative = np.concatenate(([0], np.cumsum(hits)))
+                matches = cumulative[self.source_uid_offsets[1:]] > cumulative[self.source_uid_offsets[:-1]]
+            mask &= ~matches if operation in ("ne", "not_in") else matches
+        return mask
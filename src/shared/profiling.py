@@ -0,0 +1,316 @@
+import contextvars
+import functools
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import time
+import tracemalloc
+import uuid
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+from typing import Any, Callable, ContextManager, Dict, Iterator, Optional, Set
+
+from src.shared.config import PROFILES_FOLDER
+
+logger = logging.getLogger(__name__)
+
+# Интервал сэмплирования стеков для flamegraph, секунды
+SAMPLE_INTERVAL = float(os.getenv("PROFILE_SAMPLE_INTERVAL", "0.01"))
+
+# Сколько мест выделения памяти с наибольшим объемом включать в отчет
+TOP_ALLOCATIONS = 10
+
+# Сколько последних отчетов хранить в каталоге отчетов
+KEEP_REPORTS = int(os.getenv("PROFILE_KEEP_REPORTS", "100"))
+
+# Допустимый идентификатор прогона (защита от выхода за каталог отчетов)
+RUN_ID_PATTERN = re.compile(r"^[\w-]+$")
+
+# Профилировщик текущего прогона (индексации или запроса)
+_CURRENT: contextvars.ContextVar[Optional["Profiler"]] = contextvars.ContextVar("profiler", default=None)
+
+# tracemalloc общий для процесса: трассировка работает, пока ее использует хотя бы один профилировщик
+_TRACEMALLOC_LOCK = threading.Lock()
+_TRACEMALLOC_USERS = 0
+
+
+def _acquire_tracemalloc() -> None:
+    global _TRACEMALLOC_USERS
+    with _TRACEMALLOC_LOCK:
+        if _TRACEMALLOC_USERS == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        _TRACEMALLOC_USERS += 1
+
+
+def _release_tracemalloc() -> None:
+    global _TRACEMALLOC_USERS
+    with _TRACEMALLOC_LOCK:
+        _TRACEMALLOC_USERS -= 1
+        if _TRACEMALLOC_USERS == 0:
+            tracemalloc.stop()
+
+
+class Profiler:
+    """
+    Профилировщик одного прогона индексации или одного запроса.
+
+    Этапы отмечаются контекстным менеджером stage(); для каждого этапа
+    накапливаются число вызовов, время по часам и процессорное время.
+    Вложенные этапы записываются с путем родителя ("process_data/clean_text").
+    По желанию в отдельном потоке сэмплируются стеки профилируемых потоков
+    (свернутые стеки для flamegraph) и включается tracemalloc для пика памяти.
+
+    tracemalloc работает на весь процесс: пока он включен, замедляются все
+    потоки, а пик памяти в отчете - это пик процесса с начала прогона
+    (или с начала другого прогона с memory, начавшегося позже), а не
+    только выделения этого прогона.
+    """
+
+    def __init__(
+            self,
+            name: str,
+            flamegraph: bool = False,
+            memory: bool = False,
+            sample_interval: float = SAMPLE_INTERVAL,
+            cpu_clock: Callable[[], float] = time.process_time
+    ):
+        """
+        Args:
+            name: Название прогона (часть имени отчета)
+            flamegraph: Сэмплировать ли стеки для flamegraph
+            memory: Отслеживать ли пик памяти через tracemalloc
+            sample_interval: Интервал сэмплирования стеков, секунды
+            cpu_clock: Часы процессорного времени (time.thread_time для запросов,
+                выполняющихся параллельно в одном процессе)
+        """
+        self.name = name
+        self.run_id = f"{name}-{time.strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        self.flamegraph = flamegraph
+        self.memory = memory
+        self._sample_interval = sample_interval
+        self._cpu_clock = cpu_clock
+
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._stages: Dict[str, Dict[str, float]] = {}
+        self._threads: Set[int] = set()
+        self._samples: Counter = Counter()
+        self._stop = threading.Event()
+        self._sampler: Optional[threading.Thread] = None
+        self._started_at = 0.0
+        self._cpu_started_at = 0.0
+        self._wall = 0.0
+        self._cpu = 0.0
+        self._memory_report: Optional[Dict[str, Any]] = None
+
+    def start(self) -> "Profiler":
+        """Начинает прогон: запускает сэмплирование и tracemalloc, если они включены."""
+        if self._started_at:
+            raise RuntimeError(f"Профилировщик {self.run_id} уже запущен")
+        self._started_at = time.perf_counter()
+        self._cpu_started_at = self._cpu_clock()
+        self._threads.add(threading.get_ident())
+        if self.memory:
+            _acquire_tracemalloc()
+            tracemalloc.reset_peak()
+        if self.flamegraph:
+            self._sampler = threading.Thread(target=self._sample, name=f"sampler-{self.run_id}", daemon=True)
+            self._sampler.start()
+        return self
+
+    def stop(self) -> None:
+        """Завершает прогон и останавливает сэмплирование и tracemalloc."""
+        self._wall = time.perf_counter() - self._started_at
+        self._cpu = self._cpu_clock() - self._cpu_started_at
+        if self._sampler is not None:
+            self._stop.set()
+            self._sampler.join()
+        if self.memory:
+            current, peak = tracemalloc.get_traced_memory()
+            top = tracemalloc.take_snapshot().statistics("lineno")[:TOP_ALLOCATIONS]
+            _release_tracemalloc()
+            self._memory_report = {
+                "current_bytes": current,
+                "peak_bytes": peak,
+                "top_allocations": [{"location": str(stat.traceback), "bytes": stat.size, "count": stat.count}
+                                    for stat in top],
+            }
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        """Отмечает этап прогона, накапливая его время по часам и процессорное время."""
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+            with self._lock:
+                self._threads.add(threading.get_ident())
+        path = "/".join(stack + [name])
+        stack.append(name)
+        wall_started_at, cpu_started_at = time.perf_counter(), self._cpu_clock()
+        try:
+            yield
+        finally:
+            wall, cpu = time.perf_counter() - wall_started_at, self._cpu_clock() - cpu_started_at
+            stack.pop()
+            with self._lock:
+                stats = self._stages.setdefault(path, {"calls": 0, "wall": 0.0, "cpu": 0.0, "max_wall": 0.0})
+                stats["calls"] += 1
+                stats["wall"] += wall
+                stats["cpu"] += cpu
+                stats["max_wall"] = max(stats["max_wall"], wall)
+
+    def _sample(self) -> None:
+        """Периодически записывает стеки профилируемых потоков в свернутом формате."""
+        while not self._stop.wait(self._sample_interval):
+            frames = sys._current_frames()
+            with self._lock:
+                threads = list(self._threads)
+            for ident in threads:
+                frame = frames.get(ident)
+                if frame is None:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                self._samples[";".join(reversed(stack))] += 1
+
+    def report(self) -> Dict[str, Any]:
+        """Возвращает сводку прогона: этапы по убыванию времени, пик памяти и число сэмплов."""
+        with self._lock:
+            stages = {
+                path: {
+                    "calls": int(stats["calls"]),
+                    "wall_seconds": round(stats["wall"], 6),
+                    "cpu_seconds": round(stats["cpu"], 6),
+                    "max_wall_seconds": round(stats["max_wall"], 6),
+                    "wall_share": round(stats["wall"] / self._wall, 4) if self._wall else 0.0,
+                }
+                for path, stats in sorted(self._stages.items(), key=lambda item: -item[1]["wall"])
+            }
+        return {
+            "run_id": self.run_id,
+            "name": self.name,
+            "wall_seconds": round(self._wall, 6),
+            "cpu_seconds": round(self._cpu, 6),
+            "stages": stages,
+            "memory": self._memory_report,
+            "samples": sum(self._samples.values()) if self.flamegraph else None,
+        }
+
+    def save(self, folder: str = PROFILES_FOLDER, keep: int = KEEP_REPORTS) -> str:
+        """
+        Сохраняет отчет прогона и свернутые стеки для flamegraph.
+
+        Свернутые стеки (<run_id>.folded) открываются в speedscope или
+        преобразуются в SVG утилитой flamegraph.pl. В каталоге остаются
+        только keep последних отчетов.
+
+        Args:
+            folder: Каталог отчетов
+            keep: Сколько последних отчетов хранить
+
+        Returns:
+            str: Путь к отчету
+        """
+        os.makedirs(folder, exist_ok=True)
+        path = os.path.join(folder, f"{self.run_id}.json")
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.report(), f, ensure_ascii=False, indent=2)
+        if self.flamegraph:
+            with open(os.path.join(folder, f"{self.run_id}.folded"), 'w', encoding='utf-8') as f:
+                for stack, count in self._samples.most_common():
+                    f.write(f"{stack} {count}\n")
+        logger.info(f"Отчет профилирования {self.run_id} сохранен в {path}")
+        prune_reports(folder, keep)
+        return path
+
+
+def prune_reports(folder: str = PROFILES_FOLDER, keep: int = KEEP_REPORTS) -> None:
+    """Удаляет отчеты (и их свернутые стеки), кроме keep последних по времени изменения (0 - хранить все)."""
+    if keep <= 0:
+        return
+    reports = []
+    for name in os.listdir(folder):
+        if name.endswith(".json"):
+            try:
+                reports.append((os.path.getmtime(os.path.join(folder, name)), name[:-len(".json")]))
+            except FileNotFoundError:
+                continue
+    for _, run_id in sorted(reports)[:-keep]:
+        for suffix in (".json", ".folded"):
+            try:
+                os.remove(os.path.join(folder, run_id + suffix))
+            except FileNotFoundError:
+                pass
+
+
+@contextmanager
+def profile_run(profiler: Optional[Profiler], folder: str = PROFILES_FOLDER) -> Iterator[Optional[Profiler]]:
+    """
+    Профилирует прогон: запускает профилировщик, делает его текущим и сохраняет отчет по завершении.
+
+    Отчет сохраняется и при ошибке прогона. Без профилировщика ничего не делает.
+
+    Args:
+        profiler: Профилировщик прогона или None
+        folder: Каталог отчетов
+    """
+    if profiler is None:
+        yield None
+        return
+    profiler.start()
+    try:
+        with activate(profiler):
+            yield profiler
+    finally:
+        profiler.stop()
+        try:
+            profiler.save(folder)
+        except OSError as e:
+            logger.warning(f"Не удалось сохранить отчет профилирования {profiler.run_id}: {str(e)}")
+
+
+def report_path(run_id: str, suffix: str = ".json", folder: str = PROFILES_FOLDER) -> Optional[str]:
+    """Возвращает путь к отчету прогона или None, если отчета нет."""
+    if not RUN_ID_PATTERN.match(run_id):
+        return None
+    path = os.path.join(folder, run_id + suffix)
+    return path if os.path.isfile(path) else None
+
+
+@contextmanager
+def activate(profiler: Optional[Profiler]) -> Iterator[Optional[Profiler]]:
+    """Делает профилировщик текущим для stage() и profiled() в этом потоке."""
+    token = _CURRENT.set(profiler)
+    try:
+        yield profiler
+    finally:
+        _CURRENT.reset(token)
+
+
+def current_profiler() -> Optional[Profiler]:
+    """Возвращает текущий профилировщик или None, если профилирование выключено."""
+    return _CURRENT.get()
+
+
+def stage(name: str) -> ContextManager[None]:
+    """Отмечает этап текущего профилировщика; без профилировщика ничего не делает."""
+    profiler = _CURRENT.get()
+    return profiler.stage(name) if profiler is not None else nullcontext()
+
+
+def profiled(func: Callable) -> Callable:
+    """Декоратор, записывающий вызовы функции как этап текущего профилировщика."""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        profiler = _CURRENT.get()
+        if profiler is None:
+            return func(*args, **kwargs)
+        with profiler.stage(func.__name__):
+            return func(*args, **kwargs)
+    return wrapper
@@ -0,0 +1,15 @@
+import hashlib
+import re
+
+# Размер хэша текста в байтах
+TEXT_HASH_SIZE = 16
+
+
+def text_hash(text: str) -> bytes:
+    """Возвращает хэш содержимого текста, используемый как ключ кэша эмбеддингов."""
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=TEXT_HASH_SIZE).digest()
+
+
+def safe_name(name: str) -> str:
+    """Преобразует произвольную строку (например, имя модели) в имя каталога."""
+    return re.sub(r"[^\w.@-]", "_", name)
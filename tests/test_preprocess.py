@@ -0,0 +1,164 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+# Модули службы индексации импортируют друг друга и по полному, и по короткому пути
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, 'src', 'indexing_service')]
+
+from src.indexing_service.processing import (  # noqa: E402
+    choose_lsh_bands, chunk_source_uids, compute_minhash_signatures, find_near_duplicate_clusters, process_data,
+    remove_near_duplicates, split_text_by_sentences, split_text_spans
+)
+
+BASE = "Город Люксембург впервые упоминается в документах десятого века как крепость на скале Бок."
+OTHER = "Московский футбольный клуб ЦСКА основан в 1911 году и много раз становился чемпионом страны."
+
+
+def test_minhash_signatures_shape_and_determinism():
+    texts = [BASE, OTHER, "кот"]
+    first = compute_minhash_signatures(texts, num_perm=64, n_jobs=1)
+    second = compute_minhash_signatures(texts, num_perm=64, n_jobs=1)
+
+    assert first.shape == (3, 64)
+    assert first.dtype == np.uint32
+    np.testing.assert_array_equal(first, second)
+
+
+def test_minhash_signatures_do_not_depend_on_batching(monkeypatch):
+    texts = [BASE, OTHER, BASE + " Дополнение.", "кот"]
+    whole = compute_minhash_signatures(texts, n_jobs=1)
+    monkeypatch.setattr("src.indexing_service.processing.MINHASH_MAX_BATCH_SHINGLES", 1)
+    np.testing.assert_array_equal(compute_minhash_signatures(texts, n_jobs=1), whole)
+
+
+def test_minhash_similarity_estimates_jaccard():
+    signatures = compute_minhash_signatures([BASE, BASE.upper(), BASE + " Крепость", OTHER], n_jobs=1)
+
+    def similarity(i, j):
+        return (signatures[i] == signatures[j]).mean()
+
+    # Регистр не учитывается, небольшое дополнение почти не меняет сигнатуру
+    assert similarity(0, 1) == 1.0
+    assert similarity(0, 2) > 0.7
+    assert similarity(0, 3) < 0.2
+
+
+def test_minhash_empty_input():
+    assert compute_minhash_signatures([], num_perm=16, n_jobs=1).shape == (0, 16)
+
+
+@pytest.mark.parametrize("threshold", [0.5, 0.8, 0.9])
+def test_choose_lsh_bands(threshold):
+    bands, rows = choose_lsh_bands(128, threshold)
+
+    assert bands * rows == 128
+    # Подобранный порог LSH ближе к заданному, чем у любого другого разбиения
+    best = abs((1 / bands) ** (1 / rows) - threshold)
+    for r in (1, 2, 4, 8, 16, 32, 64, 128):
+        assert best <= abs((1 / (128 // r)) ** (1 / r) - threshold)
+
+
+def test_find_near_duplicate_clusters():
+    texts = [BASE, OTHER, BASE + ".", OTHER + "!", "Совершенно другой текст про реку Волгу и ее притоки."]
+    labels = find_near_duplicate_clusters(compute_minhash_signatures(texts, n_jobs=1), threshold=0.8)
+
+    assert labels[0] == labels[2]
+    assert labels[1] == labels[3]
+    assert len({labels[0], labels[1], labels[4]}) == 3
+
+
+def test_remove_near_duplicates_keeps_first_and_reports():
+    df = pd.DataFrame({
+        "uid": range(5),
+        "text": [BASE, OTHER, BASE + ".", BASE + "!", "Совершенно другой текст про реку Волгу и ее притоки."],
+    })
+    result = remove_near_duplicates(df, threshold=0.8, n_jobs=1)
+
+    assert result["uid"].tolist() == [0, 1, 4]
+    report = result.attrs["near_duplicates"]
+    assert report["rows_before"] == 5
+    assert report["rows_after"] == 3
+    assert report["removed"] == 2
+    assert report["clusters"] == 1
+    assert report["rows_in_clusters"] == 3
+    assert report["largest_clusters"] == [3]
+    assert report["reduction"] == pytest.approx(0.4)
+
+
+def test_remove_near_duplicates_merges_lists_into_kept_row():
+    df = pd.DataFrame({
+        "uid": range(4),
+        "text": [BASE, OTHER, BASE + ".", BASE + "!"],
+        "source_uids": [[0], [1], [2], [3]],
+    })
+    result = remove_near_duplicates(df, threshold=0.8, n_jobs=1, merge_column="source_uids")
+
+    assert result["source_uids"].tolist() == [[0, 2, 3], [1]]
+    # Исходный DataFrame не меняется
+    assert df["source_uids"].tolist() == [[0], [1], [2], [3]]
+
+
+def test_remove_near_duplicates_without_duplicates():
+    df = pd.DataFrame({"uid": [0, 1], "text": [BASE, OTHER]})
+    result = remove_near_duplicates(df, threshold=0.9, n_jobs=1)
+
+    assert result["uid"].tolist() == [0, 1]
+    assert result.attrs["near_duplicates"]["removed"] == 0
+
+
+def test_split_text_spans_are_sentence_slices():
+    text = "Первое предложение. Второе предложение! Третье? Четвертое предложение."
+    spans = split_text_spans(text, 40)
+
+    assert len(spans) > 1
+    assert [text[start:end] for start, end in spans] == split_text_by_sentences(text, 40)
+    assert " ".join(split_text_by_sentences(text, 40)) == text
+
+
+def test_chunk_source_uids_by_overlap():
+    # Фрагменты начинаются с позиций 0, 10 и 20 текста длины 30
+    spans = [(0, 8), (8, 15), (20, 30)]
+
+    assert chunk_source_uids([1, 2, 3], [0, 10, 20], 30, spans) == [[1], [1, 2], [3]]
+
+
+def test_process_data_assigns_source_uids_per_chunk():
+    first = "Первое предложение первого фрагмента. Второе предложение первого фрагмента."
+    second = "Второй фрагмент рассказывает о другом. Еще одно предложение второго фрагмента."
+    df = pd.DataFrame({
+        "uid": [7, 8, 9],
+        "ru_wiki_pageid": [1, 1, 2],
+        "text": [first, second, OTHER],
+    })
+    result = process_data(df, max_length=80, near_duplicate_threshold=None)
+
+    # Части страницы несут uid только тех фрагментов, текст которых в них попал
+    assert result[["text", "source_uids"]].values.tolist() == [
+        [first + ".", [7]],
+        ["Второй фрагмент рассказывает о другом.", [8]],
+        ["Еще одно предложение второго фрагмента.", [8]],
+        [OTHER, [9]],
+    ]
+    assert "source_offsets" not in result.columns
+
+
+def test_process_data_removes_near_duplicate_fragments_before_join():
+    unique = "Второй фрагмент первой страницы рассказывает о реке Волге и ее притоках."
+    df = pd.DataFrame({
+        "uid": [1, 2, 3, 4],
+        "ru_wiki_pageid": [10, 10, 20, 20],
+        "text": [BASE, unique, BASE + ".", OTHER],
+    })
+    result = process_data(df, near_duplicate_threshold=0.8)
+
+    # Удаляется только повторяющийся фрагмент, остальной текст страницы 20 остается,
+    # а uid удаленного фрагмента переходит к оставленному
+    assert result[["ru_wiki_pageid", "text", "source_uids"]].values.tolist() == [
+        [10, f"{BASE}. {unique}", [1, 3, 2]],
+        [20, OTHER, [4]],
+    ]
+    assert result.attrs["near_duplicates"]["removed"] == 1
@@ -0,0 +1,725 @@
+import asyncio
+import os
+import sys
+import threading
+import time
+import types
+
+import faiss
+import numpy as np
+import pytest
+
+# Модули службы запросов импортируют друг друга по короткому пути
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, 'src', 'query_service')]
+
+import query  # noqa: E402
+from admission import AdmissionController, Deadline, DeadlineExceededError, QueueFullError  # noqa: E402
+from coalescing import SingleFlight  # noqa: E402
+from index_store import LEGACY_VERSION_PREFIX, IndexStore  # noqa: E402
+from src.shared import embeddings  # noqa: E402
+from src.shared.bundles import (  # noqa: E402
+    CURRENT_POINTER, INDEX_FILE, METADATA_FILE, STAGING_PREFIX, bundle_path, current_version, list_bundles,
+    load_manifest, prune_bundles, publish_bundle, verify_bundle
+)
+from src.shared.embeddings import EmbeddingCache, QueryEmbeddingCache  # noqa: E402
+from src.shared.hierarchy import PageIndex  # noqa: E402
+from src.shared.metadata import ChunkMetadata, FilterError, parse_filters  # noqa: E402
+from src.shared.profiling import Profiler, profile_run, profiled, prune_reports, report_path, stage  # noqa: E402
+from src.shared.utils import TEXT_HASH_SIZE, text_hash  # noqa: E402
+
+
+def test_single_flight_coalesces_identical_requests():
+    flight = SingleFlight()
+    release = threading.Event()
+    generations = []
+
+    def produce(deadline):
+        generations.append(deadline)
+        release.wait(5)
+        yield "от"
+        yield "вет"
+
+    entries = [flight.attach("вопрос", produce, Deadline(10)) for _ in range(5)]
+    release.set()
+
+    assert all(entry is entries[0] for entry in entries)
+    assert [entry.result(Deadline(5)) for entry in entries] == ["ответ"] * 5
+    assert len(generations) == 1
+    stats = flight.stats()
+    assert stats["generations_started"] == 1
+    assert stats["requests_coalesced"] == 4
+
+
+def test_single_flight_streams_from_first_chunk_to_late_subscribers():
+    flight = SingleFlight()
+    first_published = threading.Event()
+    release = threading.Event()
+
+    def produce(deadline):
+        yield "а"
+        first_published.set()
+        release.wait(5)
+        yield "б"
+
+    leader = flight.attach("вопрос", produce, Deadline(10))
+    assert first_published.wait(5)
+    follower = flight.attach("вопрос", produce, Deadline(10))
+    release.set()
+
+    assert follower is leader
+    assert list(follower.stream(Deadline(5))) == ["а", "б"]
+
+
+def test_single_flight_starts_new_generation_after_finish():
+    flight = SingleFlight()
+
+    first = flight.attach("вопрос", lambda deadline: iter(["1"]), Deadline(10))
+    assert first.result(Deadline(5)) == "1"
+    # Запись о генерации удаляется до публикации окончания, поэтому новый запрос запускает свежую генерацию
+    second = flight.attach("вопрос", lambda deadline: iter(["2"]), Deadline(10))
+
+    assert second is not first
+    assert second.result(Deadline(5)) == "2"
+    assert flight.stats()["in_flight"] == 0
+
+
+def test_single_flight_different_keys_do_not_coalesce():
+    flight = SingleFlight()
+
+    a = flight.attach("a", lambda deadline: iter(["a"]), Deadline(10))
+    b = flight.attach("b", lambda deadline: iter(["b"]), Deadline(10))
+
+    assert (a.result(Deadline(5)), b.result(Deadline(5))) == ("a", "b")
+    assert flight.stats()["generations_started"] == 2
+
+
+def test_single_flight_propagates_errors_to_all_subscribers():
+    flight = SingleFlight()
+    release = threading.Event()
+
+    def produce(deadline):
+        release.wait(5)
+        raise RuntimeError("сбой")
+        yield  # pragma: no cover
+
+    entries = [flight.attach("вопрос", produce, Deadline(10)) for _ in range(2)]
+    release.set()
+
+    for entry in entries:
+        with pytest.raises(RuntimeError, match="сбой"):
+            entry.result(Deadline(5))
+
+
+def test_single_flight_follower_extends_generation_deadline():
+    flight = SingleFlight()
+    release = threading.Event()
+
+    def produce(deadline):
+        release.wait(5)
+        yield "ok"
+
+    leader = flight.attach("вопрос", produce, Deadline(1))
+    flight.attach("вопрос", produce, Deadline(100))
+
+    assert leader.deadline.remaining() > 50
+    release.set()
+    assert leader.result(Deadline(5)) == "ok"
+
+
+def test_subscriber_deadline_expires_while_waiting():
+    flight = SingleFlight()
+    release = threading.Event()
+
+    def produce(deadline):
+        release.wait(5)
+        yield "поздно"
+
+    entry = flight.attach("вопрос", produce, Deadline(10))
+    with pytest.raises(DeadlineExceededError):
+        entry.result(Deadline(0.05))
+    release.set()
+
+
+def _wait_for(condition, timeout=5.0):
+    """Ждет выполнения условия, опрашивая его."""
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "условие не выполнилось вовремя"
+        time.sleep(0.005)
+
+
+def test_admission_serves_interactive_lane_before_batch():
+    controller = AdmissionController(max_concurrency=1, queue_limits={"interactive": 4, "batch": 4})
+    controller.acquire("interactive", Deadline(10))
+    order = []
+
+    def worker(priority):
+        controller.acquire(priority, Deadline(10))
+        order.append(priority)
+        controller.release(0.01)
+
+    # Пакетный запрос встает в очередь раньше интерактивного
+    batch = threading.Thread(target=worker, args=("batch",))
+    batch.start()
+    _wait_for(lambda: controller.stats()["lanes"]["batch"]["depth"] == 1)
+    interactive = threading.Thread(target=worker, args=("interactive",))
+    interactive.start()
+    _wait_for(lambda: controller.stats()["lanes"]["interactive"]["depth"] == 1)
+
+    controller.release(0.01)
+    batch.join(5)
+    interactive.join(5)
+    assert order == ["interactive", "batch"]
+
+
+def test_admission_rejects_when_lane_queue_is_full():
+    controller = AdmissionController(max_concurrency=1, queue_limits={"interactive": 1, "batch": 1})
+    controller.acquire("batch", Deadline(10))
+    waiter = threading.Thread(target=lambda: (controller.acquire("batch", Deadline(10)), controller.release(0.01)))
+    waiter.start()
+    _wait_for(lambda: controller.stats()["lanes"]["batch"]["depth"] == 1)
+
+    with pytest.raises(QueueFullError) as error:
+        controller.acquire("batch", Deadline(10))
+    assert error.value.status_code == 429
+    assert error.value.retry_after >= 1
+    assert controller.stats()["lanes"]["batch"]["rejected_queue_full"] == 1
+
+    controller.release(0.01)
+    waiter.join(5)
+
+
+def test_admission_rejects_request_that_cannot_meet_deadline():
+    controller = AdmissionController(max_concurrency=1, queue_limits={"interactive": 4, "batch": 4})
+    controller.acquire("interactive", Deadline(10))
+    controller.release(10.0)  # среднее время обслуживания - 10 с
+    controller.acquire("interactive", Deadline(10))
+
+    # Слот освободится не раньше чем через ~10 с, а дедлайн запроса - 1 с
+    with pytest.raises(DeadlineExceededError) as error:
+        controller.acquire("interactive", Deadline(1))
+    assert error.value.status_code == 503
+    assert controller.stats()["lanes"]["interactive"]["rejected_deadline"] == 1
+
+
+def test_admission_deadline_expires_in_queue():
+    controller = AdmissionController(max_concurrency=1, queue_limits={"interactive": 4, "batch": 4})
+    controller.acquire("interactive", Deadline(10))
+
+    with pytest.raises(DeadlineExceededError):
+        controller.acquire("interactive", Deadline(0.05))
+    # Отклоненный запрос не остается в очереди
+    assert controller.stats()["lanes"]["interactive"]["depth"] == 0
+
+
+def test_admission_request_limit_rejects_without_blocking():
+    controller = AdmissionController(max_concurrency=1, queue_limits={"interactive": 4, "batch": 4},
+                                     request_limit=2)
+    controller.enter_request("interactive")
+    with controller.request("batch"):
+        with pytest.raises(QueueFullError):
+            controller.enter_request("interactive")
+    controller.enter_request("interactive")
+    assert controller.stats()["requests"] == 2
+
+
+def test_deadline_check_and_extend():
+    deadline = Deadline(0)
+    with pytest.raises(DeadlineExceededError):
+        deadline.check("поиск")
+
+    deadline.extend(Deadline(10))
+    deadline.check("поиск")
+    assert deadline.remaining() > 5
+
+
+@pytest.fixture
+def warm_up_stubs(monkeypatch):
+    """Подменяет модель и индекс для прогрева и сбрасывает готовность сервиса."""
+    monkeypatch.setattr(query, "_READY", threading.Event())
+    monkeypatch.setitem(sys.modules, "sentence_transformers", types.ModuleType("sentence_transformers"))
+    index = faiss.IndexFlatIP(3)
+    index.add(np.eye(3, dtype=np.float32))
+    loaded = []
+    monkeypatch.setattr(query, "get_model", lambda: loaded.append("model"))
+    monkeypatch.setattr(query, "get_index", lambda: (index, ChunkMetadata(["a", "b", "c"]), None))
+    monkeypatch.setattr(query, "encode_queries", lambda texts: np.ones((len(texts), 3), dtype=np.float32))
+    return loaded
+
+
+def test_warm_up_marks_service_ready(warm_up_stubs):
+    assert not query.is_ready()
+
+    timings = query.warm_up()
+
+    assert query.is_ready()
+    assert warm_up_stubs == ["model"]
+    assert set(timings) == {"import_faiss", "import_sentence_transformers", "load_model", "load_index",
+                            "dummy_encode", "dummy_search"}
+
+
+def test_failed_warm_up_keeps_service_not_ready(warm_up_stubs, monkeypatch):
+    def missing_index():
+        raise FileNotFoundError("индекс не опубликован")
+
+    monkeypatch.setattr(query, "get_index", missing_index)
+    with pytest.raises(FileNotFoundError):
+        query.warm_up()
+    assert not query.is_ready()
+
+
+def test_ready_endpoint_reports_warm_up(warm_up_stubs):
+    pytest.importorskip("fastapi")
+    import main
+
+    response = asyncio.run(main.ready_endpoint())
+    assert response.status_code == 503
+
+    query.warm_up()
+    assert asyncio.run(main.ready_endpoint()) == {"status": "ready"}
+
+
+class FakeModel:
+    """Модель-заглушка: эмбеддинг текста - его длина и код первого символа."""
+
+    def __init__(self):
+        self.calls = []
+
+    def encode(self, texts, **kwargs):
+        self.calls.append(list(texts))
+        return np.array([[len(text), ord(text[0]), 0, 1] for text in texts], dtype=np.float32)
+
+
+@pytest.fixture
+def fake_model(monkeypatch, tmp_path):
+    model = FakeModel()
+    monkeypatch.setattr(embeddings, "get_model", lambda name=None, revision=None: model)
+    monkeypatch.setattr(embeddings, "EMBEDDING_CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(embeddings, "_CACHES", {})
+    return model
+
+
+def test_encode_merges_cache_hits_and_misses(fake_model):
+    first = embeddings.encode(["кот", "собака"])
+    second = embeddings.encode(["собака", "ёж", "кот"])
+
+    assert fake_model.calls == [["кот", "собака"], ["ёж"]]
+    np.testing.assert_array_equal(second, fake_model.encode(["собака", "ёж", "кот"]))
+    np.testing.assert_array_equal(second[[2, 0]], first)
+
+
+def test_encode_deduplicates_repeated_texts(fake_model):
+    result = embeddings.encode(["кот", "кот", "ёж", "кот"])
+
+    assert fake_model.calls == [["кот", "ёж"]]
+    np.testing.assert_array_equal(result, fake_model.encode(["кот", "кот", "ёж", "кот"]))
+
+
+def _vectors(n, dim=4):
+    return np.arange(n * dim, dtype=np.float32).reshape(n, dim)
+
+
+def test_embedding_cache_sees_rows_appended_by_another_instance(tmp_path):
+    reader, writer = EmbeddingCache(str(tmp_path)), EmbeddingCache(str(tmp_path))
+    hashes = [text_hash("кот"), text_hash("ёж")]
+    assert reader.lookup(hashes).tolist() == [-1, -1]
+
+    writer.put(hashes[:1], _vectors(1))
+    writer.put(hashes, _vectors(2))
+
+    rows = reader.lookup(hashes)
+    assert rows.tolist() == [0, 1]
+    np.testing.assert_array_equal(reader.read(rows), _vectors(2)[[0, 1]])
+
+
+def test_embedding_cache_rejects_other_dimension(tmp_path):
+    EmbeddingCache(str(tmp_path)).put([text_hash("кот")], _vectors(1, dim=4))
+
+    # Размерность читается из meta.json и новым экземпляром
+    with pytest.raises(ValueError):
+        EmbeddingCache(str(tmp_path)).put([text_hash("ёж")], _vectors(1, dim=3))
+
+
+def test_embedding_cache_truncates_torn_tail(tmp_path):
+    cache = EmbeddingCache(str(tmp_path))
+    cache.put([text_hash("кот"), text_hash("ёж")], _vectors(2))
+    # Прерванная запись: лишний вектор без ключа, половина вектора и половина ключа
+    with open(tmp_path / "vectors.f32", 'ab') as f:
+        f.write(_vectors(1).tobytes() + b"\0" * 8)
+    with open(tmp_path / "keys.bin", 'ab') as f:
+        f.write(b"\1" * (TEXT_HASH_SIZE // 2))
+
+    reopened = EmbeddingCache(str(tmp_path))
+    assert reopened.lookup([text_hash("кот"), text_hash("ёж")]).tolist() == [0, 1]
+    reopened.put([text_hash("лиса")], _vectors(1) + 100)
+
+    assert os.path.getsize(tmp_path / "keys.bin") == 3 * TEXT_HASH_SIZE
+    assert os.path.getsize(tmp_path / "vectors.f32") == 3 * 4 * 4
+    rows = EmbeddingCache(str(tmp_path)).lookup([text_hash("лиса")])
+    np.testing.assert_array_equal(reopened.read(rows), _vectors(1) + 100)
+
+
+def test_encode_queries_uses_bounded_memory_cache(fake_model, monkeypatch, tmp_path):
+    monkeypatch.setattr(embeddings, "_QUERY_CACHE", QueryEmbeddingCache(max_size=2))
+
+    embeddings.encode_queries(["кот", "ёж"])
+    embeddings.encode_queries(["кот", "лиса"])
+    embeddings.encode_queries(["ёж"])
+
+    # "ёж" вытеснен из кэша на два вопроса, дисковый кэш не используется
+    assert fake_model.calls == [["кот", "ёж"], ["лиса"], ["ёж"]]
+    assert os.listdir(tmp_path) == []
+
+
+def test_parse_filters_forms():
+    parsed = parse_filters({"ru_wiki_pageid": 5, "source_uid": {"in": [1, 2], "ne": 3}})
+
+    assert [(field, operation, values.tolist()) for field, operation, values in parsed] == [
+        ("ru_wiki_pageid", "eq", [5]),
+        ("source_uid", "in", [1, 2]),
+        ("source_uid", "ne", [3]),
+    ]
+    assert parse_filters({"ru_wiki_pageid": [1, 2.0]})[0][2].tolist() == [1, 2]
+    assert parse_filters(None) == []
+
+
+@pytest.mark.parametrize("filters", [
+    {"title": 1},
+    {"ru_wiki_pageid": {"gt": 1}},
+    {"ru_wiki_pageid": {"in": 1}},
+    {"ru_wiki_pageid": 1.5},
+    {"ru_wiki_pageid": "1"},
+    {"ru_wiki_pageid": True},
+    {"source_uid": [2 ** 63]},
+])
+def test_parse_filters_rejects_invalid_expressions(filters):
+    with pytest.raises(FilterError):
+        parse_filters(filters)
+
+
+def _metadata():
+    # Чанк 1 собран из двух исходных фрагментов, у чанка 2 их нет
+    return ChunkMetadata(
+        texts=["a", "b", "c", "d"],
+        page_ids=np.array([10, 10, 20, 30]),
+        source_uids=np.array([1, 2, 3, 4]),
+        source_uid_offsets=np.array([0, 1, 3, 3, 4]),
+    )
+
+
+@pytest.mark.parametrize("filters, expected", [
+    ({"ru_wiki_pageid": 10}, [True, True, False, False]),
+    ({"ru_wiki_pageid": {"ne": 10}}, [False, False, True, True]),
+    ({"ru_wiki_pageid": {"not_in": [10, 30]}}, [False, False, True, False]),
+    ({"source_uid": 3}, [False, True, False, False]),
+    ({"source_uid": [1, 4]}, [True, False, False, True]),
+    ({"source_uid": {"not_in": [2]}}, [True, False, True, True]),
+    ({"ru_wiki_pageid": 10, "source_uid": 2}, [False, True, False, False]),
+])
+def test_chunk_metadata_mask(filters, expected):
+    assert _metadata().mask(parse_filters(filters)).tolist() == expected
+
+
+def test_chunk_metadata_columns_round_trip():
+    metadata = ChunkMetadata.from_columns(_metadata().to_columns())
+
+    assert metadata.texts == ["a", "b", "c", "d"]
+    assert metadata.mask(parse_filters({"source_uid": 2})).tolist() == [False, True, False, False]
+    # Старый формат - список текстов без метаданных
+    assert ChunkMetadata.from_columns(["x", "y"]).mask(parse_filters({"ru_wiki_pageid": 1})).tolist() == [False, False]
+
+
+def _write_index(folder, label, dim=4):
+    """Записывает в каталог маленький индекс FAISS и метаданные с меткой версии."""
+    index = faiss.IndexFlatIP(dim)
+    index.add(np.eye(dim, dtype=np.float32))
+    faiss.write_index(index, os.path.join(folder, INDEX_FILE))
+    with open(os.path.join(folder, METADATA_FILE), 'w', encoding='utf-8') as f:
+        f.write(label)
+
+
+def _publish(folder, label, keep=3):
+    return publish_bundle(lambda staging: _write_index(staging, label), {"label": label}, folder, keep=keep)
+
+
+def _load_index(index_path, metadata_path):
+    with open(metadata_path, 'r', encoding='utf-8') as f:
+        return faiss.read_index(index_path), f.read()
+
+
+def test_publish_bundle_swaps_current_pointer(tmp_path):
+    first = _publish(str(tmp_path), "v1")
+    assert current_version(str(tmp_path)) == first
+
+    def fail(staging):
+        _write_index(staging, "сбой")
+        raise OSError("диск заполнен")
+
+    # Сбой сборки не трогает CURRENT и не оставляет временных каталогов
+    with pytest.raises(OSError):
+        publish_bundle(fail, {}, str(tmp_path))
+    assert current_version(str(tmp_path)) == first
+
+    second = _publish(str(tmp_path), "v2")
+    assert current_version(str(tmp_path)) == second
+    assert sorted(os.listdir(tmp_path)) == sorted([CURRENT_POINTER, first, second])
+    manifest = load_manifest(bundle_path(second, str(tmp_path)))
+    assert manifest["label"] == "v2"
+    assert set(manifest["files"]) == {INDEX_FILE, METADATA_FILE}
+
+
+def test_bundle_versions_are_ordered_within_one_second(tmp_path):
+    versions = [_publish(str(tmp_path), str(i), keep=10) for i in range(5)]
+
+    assert list_bundles(str(tmp_path)) == versions
+
+
+def test_verify_bundle_rejects_damaged_files(tmp_path):
+    path = bundle_path(_publish(str(tmp_path), "v1"), str(tmp_path))
+    manifest = load_manifest(path)
+    verify_bundle(path, manifest)
+
+    # Тот же размер, другое содержимое
+    with open(os.path.join(path, METADATA_FILE), 'w', encoding='utf-8') as f:
+        f.write("v2")
+    with pytest.raises(ValueError, match="Контрольная сумма"):
+        verify_bundle(path, manifest)
+
+    os.remove(os.path.join(path, METADATA_FILE))
+    with pytest.raises(ValueError, match="отсутствует"):
+        verify_bundle(path, manifest)
+
+
+def test_prune_bundles_keeps_current_and_skips_staging(tmp_path):
+    versions = [_publish(str(tmp_path), str(i), keep=10) for i in range(4)]
+    # Откат на самую старую версию и версия, которая еще собирается
+    with open(tmp_path / CURRENT_POINTER, 'w', encoding='utf-8') as f:
+        f.write(versions[0])
+    staging = tmp_path / f"{STAGING_PREFIX}99991231T235959000000-00000000"
+    staging.mkdir()
+    _write_index(str(staging), "в работе")
+    (staging / "manifest.json").write_text("{}")
+
+    prune_bundles(str(tmp_path), keep=1)
+
+    assert list_bundles(str(tmp_path)) == [versions[0], versions[-1]]
+    assert staging.exists()
+
+
+def test_index_store_swaps_new_version_in_background(tmp_path):
+    folder = str(tmp_path / "bundles")
+    first = _publish(folder, "v1")
+    store = IndexStore(_load_index, str(tmp_path / "none.bin"), str(tmp_path / "none.pkl"), folder,
+                       reload_interval=0)
+    version, index, metadata, pages = store.get()
+    assert (version, metadata, pages) == (first, "v1", None)
+    assert index.ntotal == 4
+
+    second = _publish(folder, "v2")
+    # Пока новая версия загружается, запросы обслуживает старая
+    assert store.get()[0] in (first, second)
+    _wait_for(lambda: store.get()[0] == second)
+    assert store.get()[2] == "v2"
+
+
+def test_index_store_skips_version_that_fails_to_load(tmp_path):
+    folder = str(tmp_path / "bundles")
+    first = _publish(folder, "v1")
+    loads = []
+
+    def loader(index_path, metadata_path):
+        loads.append(index_path)
+        return _load_index(index_path, metadata_path)
+
+    store = IndexStore(loader, str(tmp_path / "none.bin"), str(tmp_path / "none.pkl"), folder, reload_interval=0)
+    store.get()
+
+    broken = _publish(folder, "v2")
+    with open(os.path.join(bundle_path(broken, folder), METADATA_FILE), 'w', encoding='utf-8') as f:
+        f.write("xx")
+    store.get()
+    _wait_for(lambda: not store._loading)
+
+    # Поврежденная версия отклонена проверкой контрольных сумм и больше не загружается
+    assert store.get()[0] == first
+    time.sleep(0.05)
+    assert store.get()[0] == first
+    assert not store._loading
+    assert len(loads) == 1
+
+
+def test_index_store_falls_back_to_legacy_files(tmp_path):
+    index_path, metadata_path = str(tmp_path / INDEX_FILE), str(tmp_path / METADATA_FILE)
+    store = IndexStore(_load_index, index_path, metadata_path, str(tmp_path / "bundles"), reload_interval=0)
+    with pytest.raises(FileNotFoundError):
+        store.get()
+
+    _write_index(str(tmp_path), "старый формат")
+    version, index, metadata, pages = store.get()
+
+    assert version.startswith(LEGACY_VERSION_PREFIX)
+    assert (index.ntotal, metadata, pages) == (4, "старый формат", None)
+
+
+# Пять чанков трех страниц: страница 10 - чанки 0 и 1, страница 20 - чанк 2, страница 30 - чанки 3 и 4
+CHUNK_PAGE_IDS = np.array([10, 10, 20, 30, 30])
+CHUNK_VECTORS = np.array([[1, 0, 0], [0.9, 0.1, 0], [0, 1, 0], [0, 0, 1], [0.1, 0, 0.9]], dtype=np.float32)
+
+
+def _page_index():
+    return PageIndex.build(CHUNK_PAGE_IDS, ["десять", "двадцать", "тридцать"], np.eye(3, dtype=np.float32))
+
+
+def test_page_offsets():
+    np.testing.assert_array_equal(PageIndex.page_offsets(CHUNK_PAGE_IDS), [0, 2, 3, 5])
+    with pytest.raises(ValueError):
+        PageIndex.page_offsets(np.array([10, 20, 10]))
+
+
+def test_page_index_passage_rows_and_allowed_pages():
+    pages = _page_index()
+
+    np.testing.assert_array_equal(pages.page_ids, [10, 20, 30])
+    assert pages.passage_rows(np.array([2, 0])).tolist() == [3, 4, 0, 1]
+    assert pages.passage_rows(np.array([], dtype=np.int64)).tolist() == []
+    assert pages.allowed_pages(np.array([False, True, False, False, False])).tolist() == [True, False, False]
+
+
+def test_page_index_candidate_pages_with_mask():
+    pages = _page_index()
+    query_embedding = np.array([[1, 0.5, 0]], dtype=np.float32)
+
+    assert pages.candidate_pages(query_embedding, 2).tolist() == [0, 1]
+    assert pages.candidate_pages(query_embedding, 2, np.array([False, True, True])).tolist() == [1, 2]
+    # Страниц меньше, чем запрошено: возвращаются только существующие
+    assert pages.candidate_pages(query_embedding, 10, np.array([True, False, True])).tolist() == [0, 2]
+    assert pages.candidate_pages(query_embedding, 2, np.zeros(3, dtype=bool)).tolist() == []
+
+
+def test_page_index_save_and_load(tmp_path):
+    assert PageIndex.load(str(tmp_path)) is None
+    _page_index().save(str(tmp_path))
+    pages = PageIndex.load(str(tmp_path))
+
+    np.testing.assert_array_equal(pages.offsets, [0, 2, 3, 5])
+    assert pages.leads == ["десять", "двадцать", "тридцать"]
+    assert pages.index.ntotal == 3
+
+
+@pytest.mark.parametrize("filters, n_pages, expected", [
+    (None, 1, ["a", "b"]),
+    (None, 10, ["a", "b", "c"]),
+    ({"ru_wiki_pageid": 30}, 1, ["e", "d"]),
+    ({"ru_wiki_pageid": {"ne": 10}}, 10, ["c", "e", "d"]),
+    ({"ru_wiki_pageid": 999}, 10, []),
+])
+def test_query_index_hierarchical(monkeypatch, filters, n_pages, expected):
+    monkeypatch.setattr(query, "encode_queries", lambda texts: np.array([[1, 0.5, 0]], dtype=np.float32))
+    index = faiss.IndexFlatIP(3)
+    index.add(CHUNK_VECTORS)
+    metadata = ChunkMetadata(list("abcde"), CHUNK_PAGE_IDS)
+
+    results = query.query_index_hierarchical(index, metadata, _page_index(), "вопрос", k=3,
+                                             filters=parse_filters(filters), n_pages=n_pages)
+
+    assert results == expected
+
+
+@profiled
+def _profiled_step():
+    with stage("inner"):
+        time.sleep(0.01)
+
+
+def test_profiler_records_nested_stage_paths(tmp_path):
+    profiler = Profiler("test")
+    with profile_run(profiler, str(tmp_path)):
+        with stage("outer"):
+            _profiled_step()
+            _profiled_step()
+    # Вне прогона этапы не записываются
+    _profiled_step()
+
+    stages = profiler.report()["stages"]
+    assert set(stages) == {"outer", "outer/_profiled_step", "outer/_profiled_step/inner"}
+    assert stages["outer/_profiled_step"]["calls"] == 2
+    assert stages["outer/_profiled_step/inner"]["wall_seconds"] >= 0.02
+    assert os.listdir(tmp_path) == [f"{profiler.run_id}.json"]
+
+
+def test_profiler_cannot_start_twice():
+    profiler = Profiler("test").start()
+    with pytest.raises(RuntimeError):
+        profiler.start()
+    profiler.stop()
+
+
+def test_profiler_report_wall_share():
+    profiler = Profiler("test").start()
+    with profiler.stage("sleep"):
+        time.sleep(0.02)
+    time.sleep(0.02)
+    profiler.stop()
+
+    report = profiler.report()
+    share = report["stages"]["sleep"]["wall_share"]
+    assert 0 < share < 1
+    assert share == pytest.approx(report["stages"]["sleep"]["wall_seconds"] / report["wall_seconds"], abs=1e-3)
+
+
+def test_profile_run_saves_report_on_error(tmp_path):
+    profiler = Profiler("test", flamegraph=True, sample_interval=0.001)
+    with pytest.raises(ValueError):
+        with profile_run(profiler, str(tmp_path)):
+            time.sleep(0.02)
+            raise ValueError("сбой")
+
+    assert sorted(os.listdir(tmp_path)) == [f"{profiler.run_id}.folded", f"{profiler.run_id}.json"]
+    with profile_run(None, str(tmp_path)) as nothing:
+        assert nothing is None
+
+
+def test_prune_reports_keeps_latest(tmp_path):
+    for i in range(5):
+        for suffix in (".json", ".folded"):
+            path = tmp_path / f"run-{i}{suffix}"
+            path.write_text("{}")
+            os.utime(path, (1000 + i, 1000 + i))
+
+    prune_reports(str(tmp_path), keep=0)
+    assert len(os.listdir(tmp_path)) == 10
+
+    prune_reports(str(tmp_path), keep=2)
+    assert sorted(os.listdir(tmp_path)) == ["run-3.folded", "run-3.json", "run-4.folded", "run-4.json"]
+
+
+def test_report_path_rejects_paths_outside_folder(tmp_path):
+    (tmp_path / "secret.json").write_text("{}")
+    folder = str(tmp_path / "profiles")
+    os.makedirs(folder)
+    (tmp_path / "profiles" / "query-1.json").write_text("{}")
+
+    assert report_path("query-1", folder=folder) == os.path.join(folder, "query-1.json")
+    assert report_path("query-2", folder=folder) is None
+    assert report_path("../secret", folder=folder) is None
+    assert report_path("..", suffix="/secret.json", folder=folder) is None
+
+
+@pytest.mark.parametrize("value, options", [
+    (None, None),
+    ("", None),
+    ("0", None),
+    ("1", (False, False)),
+    ("flamegraph, Memory", (True, True)),
+])
+def test_profiler_from_header(monkeypatch, value, options):
+    monkeypatch.setattr(query, "PROFILING_ENABLED", True)
+    profiler = query.profiler_from_header(value)
+
+    if options is None:
+        assert profiler is None
+    else:
+        assert (profiler.flamegraph, profiler.memory) == options
+    monkeypatch.setattr(query, "PROFILING_ENABLED", False)
+    assert query.profiler_from_header(value) is None